@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
     'rest_framework',
     'rest_framework.authtoken',
@@ -62,6 +63,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'user.middleware.PasswordHashingBusyMiddleware',
 ]
 
 ROOT_URLCONF = 'app.urls'
@@ -88,20 +90,118 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Postgres is required in production. DB_ENGINE=django.db.backends.sqlite3
+# with DB_NAME set to a file runs the app and tests locally, recipe search
+# then falls back to substring matching. Tests of Postgres only features,
+# COPY imports, trigram matching and index plans, are skipped there.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.environ.get('DB_ENGINE', 'django.db.backends.postgresql'),
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        # Seconds a connection is kept open for the following requests of
+        # the same thread, 0 closes it after each request. Django's
+        # connections are per thread, so this is safe with uWSGI's
+        # --enable-threads and the image worker threads.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        # Set DB_POOLER=pgbouncer when DB_HOST is a PgBouncer in transaction
+        # pooling mode, where a cursor cannot outlive its transaction.
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER') == 'pgbouncer',
+    }
+}
+
+# Read replicas, as comma separated hosts sharing the name and credentials
+# of the primary. Safe requests to the recipe API read from a random
+# replica, unless the user wrote in the last READ_REPLICA_PIN_SECONDS,
+# which should exceed the replication lag. Pins are kept in the
+# READ_REPLICA_CACHE_ALIAS cache, which must be shared between workers,
+# the core.W001 check warns about a per-process cache.
+DATABASE_REPLICAS = []
+for index, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+# Disables the replicas while testing, see core/test_runner.py.
+TEST_RUNNER = 'core.test_runner.TestRunner'
+READ_REPLICA_CACHE_ALIAS = os.environ.get('READ_REPLICA_CACHE_ALIAS', 'default')
+READ_REPLICA_PIN_SECONDS = int(os.environ.get('READ_REPLICA_PIN_SECONDS', 5))
+
+# Ping a kept connection unused for DB_CONN_HEALTH_CHECK_IDLE seconds before
+# a request reuses it, see core/connections.py. The reuse rate of each
+# process is logged every DB_CONN_STATS_INTERVAL connections handed out, 0
+# disables it.
+DB_CONN_HEALTH_CHECKS = bool(int(os.environ.get('DB_CONN_HEALTH_CHECKS', 1)))
+DB_CONN_HEALTH_CHECK_IDLE = int(
+    os.environ.get('DB_CONN_HEALTH_CHECK_IDLE', 30),
+)
+DB_CONN_STATS_INTERVAL = int(os.environ.get('DB_CONN_STATS_INTERVAL', 1000))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.connections': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Defaults to a per-process LRU cache. Point CACHE_BACKEND/CACHE_LOCATION
+# at a shared backend when running several workers, so an invalidation in
+# one worker is seen by all of them. docker-compose-deploy.yml uses
+# memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'recipe-app'),
     }
 }
 
+# Cache alias and lifetime (seconds) of cached recipe, tag and ingredient
+# list responses.
+RECIPE_CACHE_ALIAS = os.environ.get('RECIPE_CACHE_ALIAS', 'default')
+RECIPE_LIST_CACHE_TIMEOUT = int(os.environ.get('RECIPE_LIST_CACHE_TIMEOUT', 60))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
+# Argon2 is used for new passwords, older PBKDF2 hashes are upgraded when
+# their user next logs in. At most PASSWORD_HASH_SLOTS hashes run at once
+# across the workers sharing the PASSWORD_HASH_CACHE_ALIAS cache, each
+# Argon2 hash using ARGON2_MEMORY_COST KiB. Keep it below the number of
+# workers, so a login flood leaves some free. Requests that cannot get a
+# slot within PASSWORD_HASH_TIMEOUT seconds are answered with 429.
+# See the benchmark_password_hashing command for tuning.
+
+PASSWORD_HASHERS = [
+    'user.hashers.Argon2PasswordHasher',
+    'user.hashers.PBKDF2PasswordHasher',
+]
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', 2))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', 19456))
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', 1))
+PASSWORD_HASH_SLOTS = int(os.environ.get('PASSWORD_HASH_SLOTS', 2))
+PASSWORD_HASH_CACHE_ALIAS = os.environ.get(
+    'PASSWORD_HASH_CACHE_ALIAS', 'default',
+)
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 0.5))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -141,6 +241,28 @@ MEDIA_URL = '/static/media/'
 MEDIA_ROOT = '/vol/web/media/'
 STATIC_ROOT = '/vol/web/static/'
 
+# Recipe image uploads are streamed to disk and refused once they exceed
+# RECIPE_IMAGE_MAX_UPLOAD_SIZE bytes (client_max_body_size in the proxy)
+# or their header states more than RECIPE_IMAGE_MAX_PIXELS pixels.
+
+RECIPE_IMAGE_MAX_UPLOAD_SIZE = int(
+    os.environ.get('RECIPE_IMAGE_MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_PIXELS = int(os.environ.get('RECIPE_IMAGE_MAX_PIXELS', 40_000_000))
+
+# Uploaded recipe images are processed by a pool of background threads.
+# The stored image fits in RECIPE_IMAGE_MAX_SIZE pixels, and WebP and JPEG
+# variants are generated for each of RECIPE_IMAGE_SIZES. Eager mode
+# processes uploads inline, once the upload is committed.
+
+RECIPE_IMAGE_WORKERS = int(os.environ.get('RECIPE_IMAGE_WORKERS', 2))
+RECIPE_IMAGE_MAX_SIZE = int(os.environ.get('RECIPE_IMAGE_MAX_SIZE', 2048))
+RECIPE_IMAGE_SIZES = [1024, 512, 128]
+RECIPE_IMAGE_QUALITY = int(os.environ.get('RECIPE_IMAGE_QUALITY', 85))
+RECIPE_IMAGE_PROCESSING_EAGER = bool(
+    int(os.environ.get('RECIPE_IMAGE_PROCESSING_EAGER', 0))
+)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -156,6 +278,55 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Token authentication caches the user of each token for
+# TOKEN_AUTH_LOCAL_TIMEOUT seconds in each process (at most
+# TOKEN_AUTH_LOCAL_SIZE tokens, 0 disables it) and TOKEN_AUTH_CACHE_TIMEOUT
+# seconds in the shared cache. The local timeout bounds how long another
+# process may still accept a token after logout. A per-process LocMemCache
+# is not shared, users are then kept there for the local timeout only.
+TOKEN_AUTH_CACHE_ALIAS = os.environ.get('TOKEN_AUTH_CACHE_ALIAS', 'default')
+TOKEN_AUTH_CACHE_TIMEOUT = int(os.environ.get('TOKEN_AUTH_CACHE_TIMEOUT', 300))
+TOKEN_AUTH_LOCAL_TIMEOUT = int(os.environ.get('TOKEN_AUTH_LOCAL_TIMEOUT', 5))
+TOKEN_AUTH_LOCAL_SIZE = int(os.environ.get('TOKEN_AUTH_LOCAL_SIZE', 1024))
+
+# Lifetime in seconds of the signed tokens issued at login. They are signed
+# with SECRET_KEY, changing it logs everyone out.
+SIGNED_TOKEN_MAX_AGE = int(os.environ.get('SIGNED_TOKEN_MAX_AGE', 7 * 24 * 60 * 60))
+
+# Default and upper bound for the page_size query param on paginated
+# list endpoints.
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 25))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 100))
+
+# Number of tags or ingredients returned for a ?q= autocomplete lookup.
+# The names of up to AUTOCOMPLETE_TRIE_USERS users (per tag/ingredient
+# kind) who made at least AUTOCOMPLETE_TRIE_MIN_REQUESTS lookups are kept
+# in an in-process prefix tree, 0 disables it.
+AUTOCOMPLETE_LIMIT = int(os.environ.get('AUTOCOMPLETE_LIMIT', 10))
+AUTOCOMPLETE_TRIE_USERS = int(os.environ.get('AUTOCOMPLETE_TRIE_USERS', 128))
+AUTOCOMPLETE_TRIE_MIN_REQUESTS = int(
+    os.environ.get('AUTOCOMPLETE_TRIE_MIN_REQUESTS', 3)
+)
+
+# Maximum number of recipes accepted by one request to the bulk endpoint.
+BULK_MAX_RECIPES = int(os.environ.get('BULK_MAX_RECIPES', 1000))
+
+# Number of recipes fetched and serialized at a time by the streaming export.
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 500))
+# Exports served over ASGI are spooled to a temporary file first, in memory
+# up to this many bytes.
+EXPORT_SPOOL_MAX_MEMORY = int(
+    os.environ.get('EXPORT_SPOOL_MAX_MEMORY', 1024 * 1024)
+)
+
+# App server started by scripts/run.sh: uwsgi or asgi (gunicorn with uvicorn
+# workers). Under ASGI the recipe list and detail and the tag and
+# ingredient lists are served by async views, see recipe/async_views.py.
+APP_SERVER = os.environ.get('APP_SERVER', 'uwsgi')
+ASYNC_READ_VIEWS = bool(int(
+    os.environ.get('ASYNC_READ_VIEWS', APP_SERVER == 'asgi')
+))
+
 SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True,
 }
@@ -47,4 +47,6 @@ class UserAdmin(BaseUserAdmin):
 admin.site.register(models.User, UserAdmin)
 admin.site.register(models.Recipe)
 admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
\ No newline at end of file
+admin.site.register(models.Ingredient)
+admin.site.register(models.RecipeImageJob)
+admin.site.register(models.RecipeImageBlob)
@@ -0,0 +1,97 @@
+"""
+Health checks and reuse metrics of persistent database connections
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_stats = {'reused': 0, 'opened': 0, 'failed_checks': 0}
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+        if name == 'failed_checks' or not settings.DB_CONN_STATS_INTERVAL:
+            return
+        used = _stats['reused'] + _stats['opened']
+        if used % settings.DB_CONN_STATS_INTERVAL == 0:
+            logger.info(
+                'Database connections: %(reused)d reused, %(opened)d opened '
+                '(%(rate).1f%% reuse), %(failed_checks)d failed health checks',
+                dict(_stats, rate=100 * _stats['reused'] / used),
+            )
+
+
+def connection_stats():
+    """ Return the connection counters of this process """
+    with _lock:
+        stats = dict(_stats)
+    used = stats['reused'] + stats['opened']
+    stats['reuse_rate'] = stats['reused'] / used if used else 0.0
+    return stats
+
+
+def reset_connection_stats():
+    """ Zero the connection counters of this process """
+    with _lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def _record_use(execute, sql, params, many, context):
+    context['connection'].last_used = time.monotonic()
+    return execute(sql, params, many, context)
+
+
+def _idle(conn):
+    """ Return whether conn went unused for DB_CONN_HEALTH_CHECK_IDLE """
+    last_used = getattr(conn, 'last_used', None)
+    return (
+        last_used is None
+        or time.monotonic() - last_used >= settings.DB_CONN_HEALTH_CHECK_IDLE
+    )
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    """ Close persistent connections that can no longer be used
+
+    Run when a request starts, after Django closed the connections older
+    than CONN_MAX_AGE. If DB_CONN_HEALTH_CHECKS is set, a kept connection
+    left idle for DB_CONN_HEALTH_CHECK_IDLE seconds is pinged first, so a
+    database restart or an idle timeout costs a reconnect instead of failing
+    the request. Connections in use are not pinged, and aliases a worker
+    does not use are pinged once per idle period.
+    """
+    for conn in connections.all():
+        if conn.connection is None or conn.in_atomic_block:
+            continue
+        if settings.DB_CONN_HEALTH_CHECKS and _idle(conn):
+            if not conn.is_usable():
+                _count('failed_checks')
+                conn.close()
+                continue
+            conn.last_used = time.monotonic()
+        _count('reused')
+
+
+@receiver(connection_created)
+def count_created_connection(connection=None, **kwargs):
+    """ Count a connection opened to the database and track its use """
+    _count('opened')
+    if connection is None:
+        return
+    connection.last_used = time.monotonic()
+    if _record_use not in connection.execute_wrappers:
+        # Placed first, so execute_wrapper() blocks still pop their own.
+        connection.execute_wrappers.insert(0, _record_use)
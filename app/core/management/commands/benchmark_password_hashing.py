@@ -0,0 +1,66 @@
+"""
+Django command to measure login throughput of the password hashers
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand, CommandError
+
+from user.hashers import PasswordHashingBusy
+
+
+class Command(BaseCommand):
+    """ Report logins per second, overall and per core, for each hasher """
+
+    help = (
+        'Verify a password repeatedly with each configured hasher, from as '
+        'many threads as there are cores, and report logins/sec per core.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=50)
+        parser.add_argument('--threads', type=int, default=None)
+
+    def handle(self, *args, **options):
+        """ Entrypoint for command """
+        if hasattr(os, 'sched_getaffinity'):
+            cores = len(os.sched_getaffinity(0))
+        else:
+            cores = os.cpu_count()
+        threads = options['threads'] or cores
+        logins = options['logins']
+        self.stdout.write(
+            f'{cores} cores, {threads} threads, '
+            f'{settings.PASSWORD_HASH_SLOTS} hashing slots, '
+            f'{logins} logins per hasher'
+        )
+
+        for hasher in get_hashers():
+            encoded = hasher.encode('benchmark password', hasher.salt())
+
+            def login(_):
+                # Each verify takes a hashing slot like a real login.
+                try:
+                    return hasher.verify('benchmark password', encoded)
+                except PasswordHashingBusy:
+                    return None
+
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                start = time.perf_counter()
+                results = list(executor.map(login, range(logins)))
+                elapsed = time.perf_counter() - start
+            refused = results.count(None)
+            if False in results:
+                raise CommandError(
+                    f'{hasher.algorithm} failed to verify its own hash.'
+                )
+            rate = (logins - refused) / elapsed
+            self.stdout.write(
+                f'{hasher.algorithm}: {rate:.1f} logins/sec, '
+                f'{rate / cores:.1f} per core, '
+                f'{elapsed / logins * 1000:.1f} ms each, '
+                f'{refused} refused as busy'
+            )
@@ -0,0 +1,105 @@
+"""
+Django command to compare the query plans of the recipe tag filters
+"""
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import Recipe, Tag
+
+
+class Command(BaseCommand):
+    """ Seed a throwaway dataset and time JOIN + DISTINCT against EXISTS """
+
+    help = (
+        'Seed recipes in a rolled back transaction and compare the plans '
+        'of the DISTINCT and EXISTS tag filters.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--tags-per-recipe', type=int, default=3)
+        parser.add_argument('--filter-tags', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        """ Entrypoint for command """
+        with transaction.atomic():
+            tag_ids = self._seed(options)
+            filter_ids = tag_ids[:options['filter_tags']]
+            user = Recipe.objects.order_by('-id').first().user
+            base = Recipe.objects.filter(user=user).order_by('-id')
+            queries = {
+                'distinct': base.filter(tags__id__in=filter_ids).distinct(),
+                'exists': base.filter_related('tags', filter_ids),
+                'exists (match all)': base.filter_related(
+                    'tags', filter_ids, match_all=True
+                ),
+            }
+            for name, queryset in queries.items():
+                self._report(name, queryset[:25], options['repeat'])
+            transaction.set_rollback(True)
+
+    def _seed(self, options):
+        """ Create the dataset and return the tag ids """
+        self.stdout.write(f"Seeding {options['recipes']} recipes...")
+        user = get_user_model().objects.create_user(
+            email='benchmark@example.com', password=None,
+        )
+        Tag.objects.bulk_create([
+            Tag(user=user, name=f'Tag {i}') for i in range(options['tags'])
+        ])
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    user=user,
+                    title=f'Recipe {i}',
+                    time_minutes=i % 120,
+                    price=Decimal(i % 100),
+                )
+                for i in range(options['recipes'])
+            ),
+            batch_size=5000,
+        )
+        # Read back, bulk_create() does not set the ids on every backend.
+        tag_ids = list(
+            Tag.objects.filter(user=user).values_list('id', flat=True)
+        )
+        recipe_ids = Recipe.objects.filter(user=user).values_list(
+            'id', flat=True,
+        )
+        per_recipe = min(options['tags_per_recipe'], len(tag_ids))
+        through = Recipe.tags.through
+        through.objects.bulk_create(
+            (
+                through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids.iterator()
+                for tag_id in random.sample(tag_ids, per_recipe)
+            ),
+            batch_size=5000,
+        )
+        with connection.cursor() as cursor:
+            for model in (Recipe, Tag, through):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+        return tag_ids
+
+    def _report(self, name, queryset, repeat):
+        """ Print the plan and the best wall clock time of the query """
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(queryset.all())
+            timings.append(time.perf_counter() - start)
+        self.stdout.write(self.style.SUCCESS(
+            f'{name}: best of {repeat} {min(timings) * 1000:.2f} ms'
+        ))
+        if connection.vendor == 'postgresql':
+            self.stdout.write(queryset.explain(analyze=True))
+        else:
+            self.stdout.write(queryset.explain())
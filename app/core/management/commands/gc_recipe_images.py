@@ -0,0 +1,105 @@
+"""
+Django command to delete recipe images no recipe uses anymore
+"""
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import RecipeImageBlob, RecipeImageJob
+from recipe.images import VARIANT_FORMATS, delete_image_files, variant_name
+
+
+class Command(BaseCommand):
+    """ Garbage collect unreferenced recipe images """
+
+    help = (
+        'Delete stored recipe images without references for longer than '
+        '--grace-minutes. With --sweep, also delete files under uploads/ '
+        'that no image or pending job knows about.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-minutes', type=int, default=60)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sweep', action='store_true')
+
+    def _delete_blobs(self, cutoff, batch_size):
+        """ Delete unreferenced blobs batch by batch, with their files """
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                # Blobs being referenced again by a job are locked, skip them.
+                blobs = list(RecipeImageBlob.objects.select_for_update(
+                    skip_locked=True,
+                ).filter(
+                    ref_count=0, updated_at__lt=cutoff,
+                ).values_list('id', 'name')[:batch_size])
+                if not blobs:
+                    return deleted
+                # Deleted while the rows are locked, a job referencing the
+                # same image waits and then stores it again.
+                for _, name in blobs:
+                    delete_image_files(name)
+                RecipeImageBlob.objects.filter(
+                    id__in=[blob_id for blob_id, _ in blobs],
+                ).delete()
+            deleted += len(blobs)
+
+    def _walk(self, path):
+        """ Yield the names of all files stored under path """
+        try:
+            dirs, files = default_storage.listdir(path)
+        except FileNotFoundError:
+            return
+        for name in files:
+            yield os.path.join(path, name)
+        for name in dirs:
+            yield from self._walk(os.path.join(path, name))
+
+    def _sweep(self, cutoff):
+        """ Delete old files that neither a blob nor a job refers to """
+        known = set()
+        names = RecipeImageBlob.objects.values_list('name', flat=True)
+        for name in names.iterator():
+            known.add(name)
+            known.update(
+                variant_name(name, size, fmt)
+                for size in settings.RECIPE_IMAGE_SIZES
+                for fmt in VARIANT_FORMATS
+            )
+        known.update(RecipeImageJob.objects.exclude(
+            source='',
+        ).values_list('source', flat=True).iterator())
+
+        deleted = 0
+        for path in (
+            os.path.join('uploads', 'recipe'),
+            os.path.join('uploads', 'incoming'),
+        ):
+            for name in self._walk(path):
+                if (
+                    name not in known
+                    and default_storage.get_modified_time(name) < cutoff
+                ):
+                    default_storage.delete(name)
+                    deleted += 1
+        return deleted
+
+    def handle(self, *args, **options):
+        """ Entrypoint for command """
+        cutoff = timezone.now() - timedelta(minutes=options['grace_minutes'])
+
+        deleted = self._delete_blobs(cutoff, options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Deleted {deleted} unused images.')
+        )
+        if options['sweep']:
+            deleted = self._sweep(cutoff)
+            self.stdout.write(
+                self.style.SUCCESS(f'Deleted {deleted} orphaned files.')
+            )
@@ -0,0 +1,211 @@
+"""
+Django command to import recipes for a user from an NDJSON or CSV file
+"""
+import csv
+import io
+import json
+import os
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.models import Recipe, Tag, Ingredient
+from recipe.cache import invalidate_user_cache
+
+
+RECIPE_FIELDS = ('title', 'description', 'time_minutes', 'price', 'link')
+""" CSV cells holding several names use this separator, e.g. Vegan|Dessert """
+CSV_LIST_SEPARATOR = '|'
+
+
+class Command(BaseCommand):
+    """ Stream a recipe file into the database in batches """
+
+    help = (
+        'Import recipes for a user from an NDJSON or CSV file. Rows have the '
+        f'fields {", ".join(RECIPE_FIELDS)}, tags and ingredients.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--email', required=True, help='Owner of the recipes',
+        )
+        parser.add_argument('--format', choices=['ndjson', 'csv'])
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Use INSERT statements even when Postgres COPY is available',
+        )
+
+    def handle(self, *args, **options):
+        """ Entrypoint for command """
+        try:
+            self.user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['email']} does not exist.")
+        file_format = options['format'] or os.path.splitext(
+            options['path'])[1].lstrip('.').lower()
+        if file_format not in ('ndjson', 'csv'):
+            raise CommandError('Unable to tell the file format, use --format.')
+
+        self.use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        # name -> id of the user's tags and ingredients resolved so far.
+        self.ids = {Tag: {}, Ingredient: {}}
+        imported = skipped = 0
+
+        with open(options['path'], newline='', encoding='utf-8') as f:
+            rows = self._read(f, file_format)
+            for chunk in self._chunks(rows, options['batch_size']):
+                batch = []
+                for line_number, row in chunk:
+                    try:
+                        batch.append(self._parse(row))
+                    except (
+                        ValidationError, ValueError, TypeError, AttributeError,
+                    ) as error:
+                        skipped += 1
+                        self.stderr.write(f'Line {line_number}: {error}')
+                if batch:
+                    with transaction.atomic():
+                        self._load(batch)
+                    imported += len(batch)
+                    self.stdout.write(f'Imported {imported} recipes...')
+
+        invalidate_user_cache(self.user)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} recipes, skipped {skipped}.'
+        ))
+
+    def _read(self, f, file_format):
+        """ Yield (line number, row) without reading the whole file """
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                yield line_number, line
+
+    def _chunks(self, rows, size):
+        """ Yield lists of at most size rows """
+        while True:
+            chunk = list(islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _names(self, value):
+        """ Return the set of names of a tags or ingredients value """
+        if isinstance(value, str):
+            value = [name for name in value.split(CSV_LIST_SEPARATOR) if name]
+        names = set()
+        for item in value or []:
+            # NDJSON rows may hold plain names or objects as in the export.
+            if isinstance(item, dict):
+                if 'name' not in item:
+                    raise ValidationError(f'Missing name in {item!r}.')
+                item = item['name']
+            name = item.strip()
+            if not name or len(name) > 255:
+                raise ValidationError(f'Invalid name {name!r}.')
+            names.add(name)
+        return names
+
+    def _parse(self, row):
+        """ Return an unsaved recipe and its tag and ingredient names """
+        if isinstance(row, str):
+            row = json.loads(row)
+        recipe = Recipe(user=self.user, **{
+            field: row[field] for field in RECIPE_FIELDS
+            if row.get(field) is not None
+        })
+        recipe.clean_fields(exclude=['user', 'image'])
+
+        return (
+            recipe,
+            self._names(row.get('tags')),
+            self._names(row.get('ingredients')),
+        )
+
+    def _load(self, batch):
+        """ Write a batch of recipes with their tags and ingredients """
+        for model, index in ((Tag, 1), (Ingredient, 2)):
+            missing = {
+                name for item in batch for name in item[index]
+            } - self.ids[model].keys()
+            objs = model.objects.get_or_create_by_names(self.user, missing)
+            self.ids[model].update(
+                (name, obj.id) for name, obj in objs.items()
+            )
+
+        recipes = [recipe for recipe, _, _ in batch]
+        if self.use_copy:
+            self._copy_recipes(recipes)
+        else:
+            Recipe.objects.bulk_create_with_ids(recipes)
+
+        for field_name, model, index in (
+            ('tags', Tag, 1), ('ingredients', Ingredient, 2),
+        ):
+            field = Recipe._meta.get_field(field_name)
+            through = field.remote_field.through
+            column = f'{field.m2m_reverse_field_name()}_id'
+            links = [
+                (item[0].id, self.ids[model][name])
+                for item in batch for name in item[index]
+            ]
+            if self.use_copy:
+                self._copy(
+                    through._meta.db_table, ('recipe_id', column), links,
+                )
+            else:
+                through.objects.bulk_create([
+                    through(recipe_id=recipe_id, **{column: related_id})
+                    for recipe_id, related_id in links
+                ])
+
+    def _copy_recipes(self, recipes):
+        """ Reserve ids from the sequence and COPY the recipe rows """
+        table = Recipe._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                'FROM generate_series(1, %s)',
+                [table, len(recipes)],
+            )
+            for recipe, (pk,) in zip(recipes, cursor.fetchall()):
+                recipe.id = pk
+
+        fields = Recipe._meta.concrete_fields
+        self._copy(table, [field.column for field in fields], [
+            [
+                field.get_db_prep_save(
+                    field.pre_save(recipe, True), connection,
+                )
+                for field in fields
+            ]
+            for recipe in recipes
+        ])
+
+    def _copy(self, table, columns, rows):
+        """ Load rows into table with COPY FROM STDIN """
+        if not rows:
+            return
+        buffer = io.StringIO()
+        # Quoting every string keeps '' apart from NULL, written unquoted.
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+        buffer.seek(0)
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {quote(table)} ({", ".join(map(quote, columns))}) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
@@ -0,0 +1,139 @@
+"""
+Django command to measure how an app server copes with slow clients
+"""
+import asyncio
+import ssl
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """ Time fast requests while slow clients trickle request bodies """
+
+    help = (
+        'Hold --slow-clients connections open, each sending a request body '
+        'over --slow-seconds, and time --probes GET requests meanwhile. '
+        'Run it once against each APP_SERVER, pointed at the app server '
+        'itself since nginx buffers request bodies (UWSGI_HTTP_SOCKET=:9001 '
+        'adds an HTTP port to uWSGI).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='URL requested by the probes')
+        parser.add_argument('--token', help='Token sent by every request')
+        parser.add_argument('--slow-clients', type=int, default=50)
+        parser.add_argument('--slow-seconds', type=float, default=10)
+        parser.add_argument('--probes', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        """ Entrypoint for command """
+        url = urlsplit(options['url'])
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise CommandError('url must be an absolute http(s) URL.')
+        self.options = options
+        self.url = url
+        self.headers = f'Host: {url.netloc}\r\nConnection: close\r\n'
+        if options['token']:
+            self.headers += f'Authorization: Token {options["token"]}\r\n'
+
+        latencies, failures, elapsed = asyncio.run(self._run())
+        self._report(latencies, failures, elapsed)
+
+    async def _open(self):
+        port = self.url.port or (443 if self.url.scheme == 'https' else 80)
+        context = None
+        if self.url.scheme == 'https':
+            context = ssl.create_default_context()
+        return await asyncio.open_connection(
+            self.url.hostname, port, ssl=context,
+        )
+
+    async def _slow_client(self):
+        """ Send a POST body one byte at a time over slow_seconds """
+        body_size = 64
+        delay = self.options['slow_seconds'] / body_size
+        try:
+            reader, writer = await self._open()
+            writer.write((
+                f'POST {self.url.path or "/"} HTTP/1.1\r\n{self.headers}'
+                f'Content-Type: application/json\r\n'
+                f'Content-Length: {body_size}\r\n\r\n'
+            ).encode())
+            for _ in range(body_size):
+                await asyncio.sleep(delay)
+                writer.write(b' ')
+                await writer.drain()
+            await reader.read()
+            writer.close()
+        except OSError:
+            # The server may give up on a slow client, that is its right.
+            pass
+
+    async def _probe(self):
+        """ Return the seconds a GET took, or None if it failed """
+        path = self.url.path or '/'
+        if self.url.query:
+            path += f'?{self.url.query}'
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                self._open(), self.options['timeout'],
+            )
+            writer.write(f'GET {path} HTTP/1.1\r\n{self.headers}\r\n'.encode())
+            response = await asyncio.wait_for(
+                reader.read(), self.options['timeout'],
+            )
+            writer.close()
+        except (OSError, asyncio.TimeoutError):
+            return None
+        if not response.startswith((b'HTTP/1.1 2', b'HTTP/1.0 2')):
+            return None
+
+        return time.perf_counter() - start
+
+    async def _run(self):
+        slow = [
+            asyncio.ensure_future(self._slow_client())
+            for _ in range(self.options['slow_clients'])
+        ]
+        # Let the slow clients take their connections first.
+        await asyncio.sleep(min(1, self.options['slow_seconds'] / 4))
+
+        slots = asyncio.Semaphore(self.options['concurrency'])
+
+        async def probe():
+            async with slots:
+                return await self._probe()
+
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(probe() for _ in range(self.options['probes']))
+        )
+        elapsed = time.perf_counter() - start
+        for task in slow:
+            task.cancel()
+        await asyncio.gather(*slow, return_exceptions=True)
+
+        latencies = sorted(result for result in results if result is not None)
+        return latencies, len(results) - len(latencies), elapsed
+
+    def _report(self, latencies, failures, elapsed):
+        """ Print throughput and latency percentiles of the probes """
+        self.stdout.write(
+            f'{self.options["slow_clients"]} slow clients, '
+            f'{len(latencies)}/{self.options["probes"]} probes succeeded '
+            f'in {elapsed:.2f} s ({len(latencies) / elapsed:.1f} req/s)'
+        )
+        if failures:
+            self.stdout.write(self.style.WARNING(f'{failures} probes failed'))
+        if latencies:
+            p95 = latencies[max(0, round(len(latencies) * 0.95) - 1)]
+            self.stdout.write(self.style.SUCCESS(
+                f'latency p50 {statistics.median(latencies) * 1000:.1f} ms, '
+                f'p95 {p95 * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms'
+            ))
@@ -0,0 +1,40 @@
+"""
+Django command to process recipe image jobs left behind by a restart
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import RecipeImageJob
+from recipe.images import process_image_job
+
+
+class Command(BaseCommand):
+    """ Process pending image jobs inline """
+
+    help = (
+        'Process pending recipe image jobs, and jobs stuck in processing '
+        'for longer than --stale-minutes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-minutes', type=int, default=10)
+
+    def handle(self, *args, **options):
+        """ Entrypoint for command """
+        stale_before = timezone.now() - timedelta(
+            minutes=options['stale_minutes'],
+        )
+        RecipeImageJob.objects.filter(
+            status=RecipeImageJob.PROCESSING, updated_at__lt=stale_before,
+        ).update(status=RecipeImageJob.PENDING)
+
+        job_ids = list(RecipeImageJob.objects.filter(
+            status=RecipeImageJob.PENDING,
+        ).order_by('id').values_list('id', flat=True))
+        for job_id in job_ids:
+            process_image_job(job_id)
+        self.stdout.write(
+            self.style.SUCCESS(f'Processed {len(job_ids)} image jobs.')
+        )
@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """ Merge tags and ingredients sharing a (user, name) into the oldest row """
+    Recipe = apps.get_model('core', 'Recipe')
+    for field_name, attr in (('tags', 'tag_id'), ('ingredients', 'ingredient_id')):
+        field = Recipe._meta.get_field(field_name)
+        model = field.related_model
+        through = field.remote_field.through
+        duplicates = model.objects.values('user', 'name').annotate(
+            keep=Min('id'), total=Count('id'),
+        ).filter(total__gt=1)
+        for duplicate in duplicates:
+            extra_ids = list(model.objects.filter(
+                user=duplicate['user'], name=duplicate['name'],
+            ).exclude(id=duplicate['keep']).values_list('id', flat=True))
+            recipe_ids = set(through.objects.filter(
+                **{f'{attr}__in': extra_ids}
+            ).values_list('recipe_id', flat=True))
+            through.objects.bulk_create(
+                [
+                    through(recipe_id=recipe_id, **{attr: duplicate['keep']})
+                    for recipe_id in recipe_ids
+                ],
+                ignore_conflicts=True,
+            )
+            model.objects.filter(id__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_recipe_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
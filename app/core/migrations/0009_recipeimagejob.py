@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:05
+
+import core.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeImageJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.FileField(upload_to=core.models.recipe_upload_file_path)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_jobs', to='core.recipe')),
+            ],
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:11
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def register_existing_images(apps, schema_editor):
+    """ Track images uploaded before deduplication as blobs
+
+    Their files stay where they are, the digest is taken from the name so
+    it cannot clash with the digest of a new upload.
+    """
+    Recipe = apps.get_model('core', 'Recipe')
+    RecipeImageBlob = apps.get_model('core', 'RecipeImageBlob')
+    images = Recipe.objects.exclude(image='').values('image').annotate(
+        total=Count('id'),
+    )
+    RecipeImageBlob.objects.bulk_create(
+        [
+            RecipeImageBlob(
+                digest=hashlib.sha256(image['image'].encode()).hexdigest(),
+                name=image['image'],
+                ref_count=image['total'],
+            )
+            for image in images.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_recipeimagejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipeimagejob',
+            name='digest',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(register_existing_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,126 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:14
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# The document of a recipe: title (A), tag and ingredient names (B) and
+# description (C).
+CREATE_SQL = [
+    """
+    CREATE FUNCTION core_recipe_search_document(
+        recipe_id bigint, title text, description text
+    ) RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('english', coalesce(title, '')), 'A')
+            || setweight(to_tsvector('english', coalesce((
+                SELECT string_agg(t.name, ' ')
+                FROM core_tag t JOIN core_recipe_tags rt ON rt.tag_id = t.id
+                WHERE rt.recipe_id = $1
+            ), '')), 'B')
+            || setweight(to_tsvector('english', coalesce((
+                SELECT string_agg(i.name, ' ')
+                FROM core_ingredient i
+                JOIN core_recipe_ingredients ri ON ri.ingredient_id = i.id
+                WHERE ri.recipe_id = $1
+            ), '')), 'B')
+            || setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    $$ LANGUAGE sql STABLE
+    """,
+    """
+    CREATE FUNCTION core_recipe_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := core_recipe_search_document(
+            NEW.id, NEW.title, NEW.description
+        );
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    # Setting search_vector to anything recomputes it, which is how the
+    # triggers below refresh recipes whose tags or ingredients changed.
+    """
+    CREATE TRIGGER core_recipe_search_vector
+    BEFORE INSERT OR UPDATE OF title, description, search_vector ON core_recipe
+    FOR EACH ROW EXECUTE PROCEDURE core_recipe_search_vector_update()
+    """,
+    """
+    CREATE FUNCTION core_recipe_links_changed() RETURNS trigger AS $$
+    BEGIN
+        UPDATE core_recipe SET search_vector = NULL
+        WHERE id IN (SELECT recipe_id FROM changed);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+]
+DROP_SQL = [
+    'DROP FUNCTION core_recipe_links_changed() CASCADE',
+    'DROP FUNCTION core_recipe_search_vector_update() CASCADE',
+    'DROP FUNCTION core_recipe_search_document(bigint, text, text)',
+    'DROP INDEX recipe_search_vector_idx',
+]
+
+for attr, through, column in (
+    ('tag', 'core_recipe_tags', 'tag_id'),
+    ('ingredient', 'core_recipe_ingredients', 'ingredient_id'),
+):
+    # Statement level, so a bulk insert refreshes each recipe once.
+    for event, table in (('INSERT', 'NEW'), ('DELETE', 'OLD')):
+        CREATE_SQL.append(f"""
+        CREATE TRIGGER {through}_search_{event.lower()}
+        AFTER {event} ON {through}
+        REFERENCING {table} TABLE AS changed
+        FOR EACH STATEMENT EXECUTE PROCEDURE core_recipe_links_changed()
+        """)
+    CREATE_SQL += [
+        f"""
+        CREATE FUNCTION core_{attr}_renamed() RETURNS trigger AS $$
+        BEGIN
+            UPDATE core_recipe SET search_vector = NULL
+            WHERE id IN (
+                SELECT recipe_id FROM {through} WHERE {column} = NEW.id
+            );
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        f"""
+        CREATE TRIGGER core_{attr}_search_rename
+        AFTER UPDATE OF name ON core_{attr}
+        FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+        EXECUTE PROCEDURE core_{attr}_renamed()
+        """,
+    ]
+    DROP_SQL.insert(0, f'DROP FUNCTION core_{attr}_renamed() CASCADE')
+
+CREATE_SQL += [
+    'CREATE INDEX recipe_search_vector_idx ON core_recipe USING gin (search_vector)',
+    # Fill in the existing recipes.
+    'UPDATE core_recipe SET search_vector = NULL',
+]
+
+
+def run_sql(statements):
+    """ Run statements on Postgres only, other databases search without them """
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_recipeimageblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(run_sql(CREATE_SQL), run_sql(DROP_SQL)),
+    ]
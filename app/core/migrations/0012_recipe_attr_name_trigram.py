@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+# Trigram indexes on UPPER(name), the expression compared by both the
+# istartswith prefix lookups and the similarity lookups of autocomplete.
+INDEXES = {
+    'tag_name_trgm_idx': 'core_tag',
+    'ingredient_name_trgm_idx': 'core_ingredient',
+}
+
+
+def create_indexes(apps, schema_editor):
+    """ Create the trigram indexes where pg_trgm can be installed
+
+    Without it autocomplete falls back to substring matching, see
+    RecipeAttrQuerySet.similar_to.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+        )
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table in INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX {name} ON {table} USING gin (UPPER(name) gin_trgm_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
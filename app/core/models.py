@@ -5,7 +5,13 @@ import uuid
 import os
 
 from django.conf import settings
-from django.db import models # noqa
+from django.utils import timezone
+from django.contrib.postgres.search import ( # noqa
+    SearchQuery, SearchRank, SearchVectorField, TrigramSimilarity,
+)
+from django.db import connections, models, transaction # noqa
+from django.db.models import Count, Exists, F, OuterRef, Q, Value # noqa
+from django.db.models.functions import Cast, Lower, Upper # noqa
 """ https://docs.djangoproject.com/en/2.2/topics/auth/customizing/#django.contrib.auth.models.AbstractBaseUser.get_username:~:text=Importing-,AbstractBaseUser,-AbstractBaseUser%20and%20BaseUserManager """ # noqa
 from django.contrib.auth.models import ( AbstractBaseUser, BaseUserManager, PermissionsMixin ) # noqa
 
@@ -17,6 +23,19 @@ def recipe_image_file_path(instance, filename):
 
     return os.path.join('uploads' ,'recipe', filename)
 
+
+def recipe_image_blob_path(digest):
+    """ Generate file path for a processed image stored under its digest. """
+    return os.path.join('uploads', 'recipe', digest[:2], f'{digest}.jpg')
+
+
+def recipe_upload_file_path(instance, filename):
+    """ Generate file path for a raw upload waiting to be processed. """
+    ext = os.path.splitext(filename)[1]
+    filename = f'{uuid.uuid4()}{ext}'
+
+    return os.path.join('uploads', 'incoming', filename)
+
 class UserManager(BaseUserManager):
     """ Manager for user."""
 
@@ -52,16 +71,93 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     """ is_staff, Login with django admin """
     is_staff = models.BooleanField(default=False)
+    """ Part of every signed auth token, bumping it revokes them all """
+    token_version = models.PositiveIntegerField(default=0)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
+
+# Text search configuration of the recipe search_vector.
+SEARCH_CONFIG = 'english'
+
+
+class RecipeQuerySet(models.QuerySet):
+    """ Queries for recipes. """
+
+    def filter_related(self, field_name, ids, match_all=False):
+        """ Filter recipes linked to any (or all) of the related ids.
+
+        Uses semi-joins on the through table rather than joining and
+        DISTINCTing the recipe rows.
+        """
+        ids = set(ids)
+        field = self.model._meta.get_field(field_name)
+        links = field.remote_field.through.objects.filter(**{
+            f'{field.m2m_reverse_field_name()}__in': ids,
+        })
+        if match_all:
+            matching = links.values('recipe_id').annotate(
+                matched=Count('id'),
+            ).filter(matched=len(ids)).values('recipe_id')
+            return self.filter(id__in=matching)
+
+        return self.filter(Exists(links.filter(recipe_id=OuterRef('pk'))))
+
+    def bulk_create_with_ids(self, objs):
+        """ Insert recipes in bulk and return them with their ids set.
+
+        Backends that cannot return the ids of a bulk insert, like SQLite
+        on this Django version, insert the recipes one at a time instead.
+        """
+        connection = connections[self.db]
+        if connection.features.can_return_rows_from_bulk_insert:
+            return self.bulk_create(objs)
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            for obj in objs:
+                obj.save(force_insert=True, using=self.db)
+
+        return objs
+
+    def search(self, text):
+        """ Filter recipes matching a search, best matches first.
+
+        On Postgres this matches the trigger-maintained search_vector and
+        orders by rank. Other databases fall back to substring matching,
+        without ranking.
+        """
+        if connections[self.db].vendor == 'postgresql':
+            query = SearchQuery(
+                text, config=SEARCH_CONFIG, search_type='websearch',
+            )
+            return self.filter(search_vector=query).annotate(
+                # A real, widened so it survives the trip through a cursor
+                # and compares equal to itself.
+                rank=Cast(
+                    SearchRank(F('search_vector'), query), models.FloatField(),
+                ),
+            ).order_by('-rank', '-id')
+
+        matches = Q(title__icontains=text) | Q(description__icontains=text)
+        for field_name in ('tags', 'ingredients'):
+            field = self.model._meta.get_field(field_name)
+            links = field.remote_field.through.objects.filter(**{
+                'recipe_id': OuterRef('pk'),
+                f'{field.m2m_reverse_field_name()}__name__icontains': text,
+            })
+            matches |= Q(Exists(links))
+        return self.filter(matches)
+
+
 class Recipe(models.Model):
     """ Recipe object. """
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        # Covered by the composite index below, which leads with user.
+        db_index=False,
     )
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
@@ -71,17 +167,129 @@ class Recipe(models.Model):
     tags = models.ManyToManyField('Tag')
     ingredients = models.ManyToManyField('Ingredient')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Title, tag and ingredient names, and description, in decreasing
+    # weight. Kept up to date by database triggers on Postgres, see
+    # migration 0011, and indexed there with GIN.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Per-user listing, newest first.
+            models.Index(
+                fields=['user', '-id'], name='recipe_user_id_desc_idx',
+            ),
+            # Per-user time and price range filters and orderings, with id
+            # as the tie-breaker of the paginated ordering.
+            models.Index(
+                fields=['user', 'time_minutes', 'id'],
+                name='recipe_user_time_idx',
+            ),
+            models.Index(
+                fields=['user', 'price', 'id'], name='recipe_user_price_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+
+_trigram_support = {}
+
+
+def has_trigram_support(using):
+    """ Return whether pg_trgm is installed in the database of alias using. """
+    if using not in _trigram_support:
+        connection = connections[using]
+        supported = False
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+                )
+                supported = cursor.fetchone() is not None
+        _trigram_support[using] = supported
+
+    return _trigram_support[using]
+
+
+class RecipeAttrQuerySet(models.QuerySet):
+    """ Queries for user owned recipe attributes. """
+
+    def starting_with(self, text):
+        """ Filter names starting with text, ignoring case, in name order. """
+        return self.filter(
+            name__istartswith=text,
+        ).order_by(Lower('name'), 'id')
+
+    def similar_to(self, text):
+        """ Filter names resembling text that do not start with it.
+
+        With pg_trgm these are the trigram matches, most similar first,
+        served by the GIN index on UPPER(name). Otherwise this falls back
+        to substring matching.
+        """
+        queryset = self.exclude(name__istartswith=text)
+        if has_trigram_support(self.db):
+            target = Upper(Value(text))
+            return queryset.annotate(upper_name=Upper('name')).filter(
+                upper_name__trigram_similar=target,
+            ).annotate(
+                similarity=TrigramSimilarity(Upper('name'), target),
+            ).order_by('-similarity', Lower('name'), 'id')
+
+        return queryset.filter(
+            name__icontains=text,
+        ).order_by(Lower('name'), 'id')
+
+
+class RecipeAttrManager(models.Manager.from_queryset(RecipeAttrQuerySet)):
+    """ Manager for user owned recipe attributes. """
+
+    def get_or_create_by_names(self, user, names):
+        """ Return a name -> object map, creating missing names in bulk. """
+        names = set(names)
+        if not names:
+            return {}
+        objs = {
+            obj.name: obj for obj in self.filter(user=user, name__in=names)
+        }
+        missing = [name for name in names if name not in objs]
+        if missing:
+            # Names inserted concurrently by another request are skipped by
+            # the (user, name) unique constraint and picked up by the SELECT.
+            self.bulk_create(
+                [self.model(user=user, name=name) for name in missing],
+                ignore_conflicts=True,
+            )
+            for obj in self.filter(user=user, name__in=missing):
+                objs[obj.name] = obj
+
+        return objs
+
+
 class Tag(models.Model):
     """ Tag to be used for a recipe. """
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        # Covered by the composite index below, which leads with user.
+        db_index=False,
     )
     name = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RecipeAttrManager()
+
+    class Meta:
+        constraints = [
+            # Also serves as the (user_id, name) index for per-user lookups.
+            models.UniqueConstraint(
+                fields=['user', 'name'], name='unique_tag_name_per_user',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -91,8 +299,81 @@ class Ingredient(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        # Covered by the composite index below, which leads with user.
+        db_index=False,
     )
     name = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RecipeAttrManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='unique_ingredient_name_per_user',
+            ),
+        ]
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class RecipeImageJob(models.Model):
+    """ Background processing of an image uploaded for a recipe. """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='image_jobs',
+    )
+    source = models.FileField(upload_to=recipe_upload_file_path)
+    digest = models.CharField(max_length=64, blank=True)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=PENDING,
+    )
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.recipe} ({self.status})'
+
+
+class RecipeImageBlobManager(models.Manager):
+    """ Manager for stored recipe images. """
+
+    def release(self, name):
+        """ Drop a reference to the image stored under name. """
+        if name:
+            self.filter(name=name, ref_count__gt=0).update(
+                ref_count=F('ref_count') - 1, updated_at=timezone.now(),
+            )
+
+
+class RecipeImageBlob(models.Model):
+    """ Processed recipe image, stored once per distinct upload.
+
+    ref_count is the number of recipes using the image, blobs left
+    without references are removed by the gc_recipe_images command.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RecipeImageBlobManager()
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,91 @@
+"""
+Database router sending the reads of safe API requests to replicas
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+
+
+# Alias reads are routed to, set for the duration of a safe request.
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def _cache():
+    return caches[settings.READ_REPLICA_CACHE_ALIAS]
+
+
+def _pin_key(user_id):
+    return f'db:pin:{user_id}'
+
+
+def pin_to_primary(user):
+    """ Read the user's data from the primary for READ_REPLICA_PIN_SECONDS """
+    _cache().set(_pin_key(user.pk), True, settings.READ_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    """ Return whether the user wrote within READ_REPLICA_PIN_SECONDS """
+    return bool(_cache().get(_pin_key(user.pk)))
+
+
+@checks.register(checks.Tags.caches)
+def check_pin_cache(app_configs, **kwargs):
+    """ Warn when the pins are only seen by the process that set them """
+    if settings.DATABASE_REPLICAS and isinstance(_cache(), LocMemCache):
+        return [checks.Warning(
+            'Read replica pins are kept in a per-process cache.',
+            hint=(
+                'Point READ_REPLICA_CACHE_ALIAS at a cache shared by every '
+                'worker, or users may not read their own writes.'
+            ),
+            id='core.W001',
+        )]
+    return []
+
+
+def start_replica_reads():
+    """ Route the reads of the current context to a random replica
+
+    Return a token for end_replica_reads, or None if there is no replica.
+    """
+    if not settings.DATABASE_REPLICAS:
+        return None
+    return _read_alias.set(random.choice(settings.DATABASE_REPLICAS))
+
+
+def end_replica_reads(token):
+    """ Undo start_replica_reads """
+    if token is not None:
+        _read_alias.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """ Send writes to the primary and reads to the chosen replica, if any
+
+    Reads go to a replica only between start_replica_reads and
+    end_replica_reads, everything else, including management commands and
+    the image workers, stays on the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Explicit, objects read from a replica would be saved there.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
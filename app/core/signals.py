@@ -0,0 +1,13 @@
+"""
+Signal handlers for the core models.
+"""
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from core.models import Recipe, RecipeImageBlob
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(sender, instance, **kwargs):
+    """ Drop the reference a deleted recipe held on its image. """
+    RecipeImageBlob.objects.release(instance.image.name)
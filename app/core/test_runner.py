@@ -0,0 +1,23 @@
+"""
+Test runner reading every query from the primary
+"""
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """ Run the tests with the read replicas disabled
+
+    Replicas are test mirrors, they see the test database but not the open
+    transaction of a TestCase. recipe/tests/test_replicas.py sets up a
+    replica of its own.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._no_replicas = override_settings(DATABASE_REPLICAS=[])
+        self._no_replicas.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._no_replicas.disable()
+        super().teardown_test_environment(**kwargs)
@@ -3,17 +3,39 @@
     # https://stackoverflow.com/questions/75042748/django-project-wait-for-database-ready-tests
 """
 """ mock behavior of database """
-from unittest.mock import patch # noqa
+from unittest import skipUnless # noqa
+from unittest.mock import call, patch # noqa
+from datetime import timedelta # noqa
 """ OperationalError is one of possiblility error we may get,
 when we try to connect db, be4 db is ready """
 from psycopg2 import OperationalError as Psycopg2Error # noqa
 
 from django.core.management import call_command # noqa
+from django.db import connection # noqa
 """ OperationalError another exception that may get through by the db,
 depending what state of the start of process """
 from django.db.utils import OperationalError # noqa
 """ Base test use for unit test. We're testing the db if avaiable. """
-from django.test import SimpleTestCase # noqa
+from django.test import SimpleTestCase, TestCase, override_settings # noqa
+from io import StringIO # noqa
+import json # noqa
+import os # noqa
+import tempfile # noqa
+from decimal import Decimal # noqa
+import threading # noqa
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer # noqa
+
+from django.contrib.auth import get_user_model # noqa
+from django.utils import timezone # noqa
+from django.core.files.base import ContentFile # noqa
+from django.core.files.storage import default_storage # noqa
+from django.core.files.uploadedfile import SimpleUploadedFile # noqa
+
+from core.models import Recipe, RecipeImageBlob, RecipeImageJob, Tag, Ingredient # noqa
+from core.management.commands import ( # noqa
+    benchmark_recipe_filters, import_recipes,
+)
+from recipe.images import variant_name # noqa
 
 
 @patch("core.management.commands.wait_for_db.Command.check")
@@ -33,3 +55,315 @@ class CommandTests(SimpleTestCase):
         call_command('wait_for_db')
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+class BenchmarkRecipeFiltersTests(TestCase):
+    """ Test the recipe filter benchmark command """
+
+    def test_benchmark_rolls_back_seeded_data(self):
+        """ Test the command reports every plan and leaves no data behind. """
+        seed = benchmark_recipe_filters.Command._seed
+        links = []
+
+        def seed_and_count(command, options):
+            tag_ids = seed(command, options)
+            links.append(Recipe.tags.through.objects.count())
+            return tag_ids
+
+        out = StringIO()
+        with patch.object(
+            benchmark_recipe_filters.Command, '_seed', autospec=True,
+            side_effect=seed_and_count,
+        ):
+            call_command(
+                'benchmark_recipe_filters', recipes=50, tags=5, repeat=1,
+                stdout=out,
+            )
+
+        output = out.getvalue()
+        self.assertIn('distinct:', output)
+        self.assertIn('exists:', output)
+        self.assertIn('exists (match all):', output)
+        self.assertEqual(links, [150])
+        self.assertFalse(Recipe.objects.exists())
+
+
+class BenchmarkPasswordHashingTests(SimpleTestCase):
+    """ Test the password hashing benchmark command """
+
+    def test_reports_each_hasher(self):
+        """ Test logins per second are reported for every hasher. """
+        out = StringIO()
+        call_command(
+            'benchmark_password_hashing', logins=2, threads=2, stdout=out,
+        )
+
+        output = out.getvalue()
+        self.assertIn('argon2:', output)
+        self.assertIn('pbkdf2_sha256:', output)
+        self.assertIn('per core', output)
+
+
+class _ProbeHandler(BaseHTTPRequestHandler):
+    """ Answer GETs, read and refuse POST bodies """
+
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'[]')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(400)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class LoadTestSlowClientsTests(SimpleTestCase):
+    """ Test the slow client load test command """
+
+    def test_reports_probe_latency(self):
+        """ Test probes are timed while slow clients are connected. """
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _ProbeHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        out = StringIO()
+        call_command(
+            'load_test_slow_clients',
+            f'http://127.0.0.1:{server.server_port}/',
+            slow_clients=2, slow_seconds=0.2, probes=5, concurrency=2,
+            stdout=out,
+        )
+
+        output = out.getvalue()
+        self.assertIn('2 slow clients, 5/5 probes succeeded', output)
+        self.assertIn('latency p50', output)
+
+
+class ImportRecipesTests(TestCase):
+    """ Test the recipe import command """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com', 'testpass',
+        )
+        Tag.objects.create(user=self.user, name='Vegan')
+
+    def _write(self, suffix, content):
+        """ Write content to a temporary file and return its path """
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def _import(self, path, **options):
+        out, err = StringIO(), StringIO()
+        call_command(
+            'import_recipes', path, email=self.user.email,
+            stdout=out, stderr=err, **options,
+        )
+        return out.getvalue(), err.getvalue()
+
+    def _assert_imported(self):
+        recipes = Recipe.objects.filter(user=self.user).order_by('id')
+        self.assertEqual(
+            [r.title for r in recipes], ['Curry', 'Salad', 'Soup'],
+        )
+        curry = recipes[0]
+        self.assertEqual(curry.price, Decimal('5.50'))
+        self.assertEqual(curry.description, '')
+        self.assertEqual(
+            sorted(tag.name for tag in curry.tags.all()), ['Spicy', 'Vegan'],
+        )
+        self.assertEqual(
+            [i.name for i in curry.ingredients.all()], ['Rice'],
+        )
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(Ingredient.objects.filter(user=self.user).count(), 2)
+
+    def _ndjson(self):
+        rows = [
+            {'title': 'Curry', 'time_minutes': 30, 'price': '5.50',
+             'tags': ['Vegan', 'Spicy'], 'ingredients': ['Rice']},
+            {'title': 'Salad', 'time_minutes': 5, 'price': '3.00',
+             'tags': [{'id': 1, 'name': 'Vegan'}]},
+            {'title': 'Soup', 'time_minutes': 20, 'price': '4.00',
+             'description': 'Warm', 'ingredients': ['Leek', 'Rice']},
+        ]
+        return '\n'.join(json.dumps(row) for row in rows) + '\n'
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY needs Postgres')
+    def test_import_ndjson_with_copy(self):
+        """ Test importing NDJSON in batches with COPY. """
+        path = self._write('.ndjson', self._ndjson())
+        with patch.object(
+            import_recipes.Command, '_copy', autospec=True,
+            side_effect=import_recipes.Command._copy,
+        ) as copy:
+            out, err = self._import(path, batch_size=2)
+
+        self._assert_imported()
+        self.assertIn(
+            Recipe._meta.db_table, [c.args[1] for c in copy.call_args_list],
+        )
+        self.assertIn('Imported 3 recipes, skipped 0.', out)
+
+    def test_import_ndjson_with_inserts(self):
+        """ Test importing NDJSON with bulk INSERT statements. """
+        self._import(self._write('.ndjson', self._ndjson()), no_copy=True)
+
+        self._assert_imported()
+
+    def test_import_csv(self):
+        """ Test importing CSV with | separated names. """
+        content = (
+            'title,time_minutes,price,description,tags,ingredients\n'
+            'Curry,30,5.50,,Vegan|Spicy,Rice\n'
+            'Salad,5,3.00,,Vegan,\n'
+            'Soup,20,4.00,Warm,,Leek|Rice\n'
+        )
+        self._import(self._write('.csv', content))
+
+        self._assert_imported()
+
+    def test_import_skips_invalid_rows(self):
+        """ Test invalid rows are reported and the rest imported. """
+        content = (
+            '{"title": "Curry", "time_minutes": 30, "price": "5.50"}\n'
+            '{"title": "Broken", "time_minutes": "soon", "price": "1.00"}\n'
+            'not json\n'
+        )
+        out, err = self._import(self._write('.ndjson', content))
+
+        self.assertIn('Imported 1 recipes, skipped 2.', out)
+        self.assertIn('Line 2', err)
+        self.assertIn('Line 3', err)
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    def test_import_skips_objects_without_name(self):
+        """ Test a tag object without a name skips its row only. """
+        content = (
+            '{"title": "Curry", "time_minutes": 30, "price": "5.50"}\n'
+            '{"title": "Salad", "time_minutes": 5, "price": "3.00", '
+            '"tags": [{"id": 1}]}\n'
+        )
+        out, err = self._import(self._write('.ndjson', content))
+
+        self.assertIn('Imported 1 recipes, skipped 1.', out)
+        self.assertIn('Line 2: ', err)
+        self.assertIn('Missing name', err)
+
+
+class ProcessImageJobsTests(TestCase):
+    """ Test the image job recovery command """
+
+    @patch('core.management.commands.process_image_jobs.process_image_job')
+    def test_process_pending_and_stale_jobs(self, patched_process):
+        """ Test pending and stale jobs are processed, fresh ones are not. """
+        user = get_user_model().objects.create_user('user@example.com', 'pass')
+        recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=Decimal('1.00'),
+        )
+        jobs = [
+            RecipeImageJob.objects.create(
+                recipe=recipe, status=job_status,
+                source=SimpleUploadedFile('a.jpg', b''),
+            )
+            for job_status in (
+                RecipeImageJob.PENDING,
+                RecipeImageJob.PROCESSING,
+                RecipeImageJob.PROCESSING,
+                RecipeImageJob.DONE,
+            )
+        ]
+        RecipeImageJob.objects.filter(id=jobs[1].id).update(
+            updated_at=jobs[1].updated_at - timedelta(hours=1),
+        )
+        for job in jobs:
+            self.addCleanup(job.source.delete, save=False)
+
+        call_command('process_image_jobs', stdout=StringIO())
+
+        patched_process.assert_has_calls([call(jobs[0].id), call(jobs[1].id)])
+        self.assertEqual(patched_process.call_count, 2)
+
+
+class GcRecipeImagesTests(TestCase):
+    """ Test the recipe image garbage collection command """
+
+    def setUp(self):
+        # --sweep deletes unknown files, keep it away from the real media.
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _blob(self, digest, ref_count, age):
+        name = default_storage.save(
+            f'uploads/recipe/{digest}.jpg', ContentFile(b'x'),
+        )
+        default_storage.save(
+            variant_name(name, 128, 'webp'), ContentFile(b'x'),
+        )
+        blob = RecipeImageBlob.objects.create(
+            digest=digest, name=name, ref_count=ref_count,
+        )
+        RecipeImageBlob.objects.filter(id=blob.id).update(
+            updated_at=timezone.now() - age,
+        )
+        return blob
+
+    def test_delete_unreferenced_images(self):
+        """ Test old unreferenced images are deleted, others are kept. """
+        unused = self._blob('a' * 64, 0, timedelta(days=1))
+        recent = self._blob('b' * 64, 0, timedelta(minutes=1))
+        used = self._blob('c' * 64, 1, timedelta(days=1))
+
+        call_command('gc_recipe_images', stdout=StringIO())
+
+        self.assertEqual(
+            set(RecipeImageBlob.objects.values_list('id', flat=True)),
+            {recent.id, used.id},
+        )
+        self.assertFalse(default_storage.exists(unused.name))
+        self.assertFalse(
+            default_storage.exists(variant_name(unused.name, 128, 'webp'))
+        )
+        self.assertTrue(default_storage.exists(recent.name))
+
+    def test_rows_kept_when_file_deletion_fails(self):
+        """ Test a blob is only deleted after its files are. """
+        unused = self._blob('e' * 64, 0, timedelta(days=1))
+
+        with patch(
+            'core.management.commands.gc_recipe_images.delete_image_files',
+            side_effect=OSError('storage unavailable'),
+        ), self.assertRaises(OSError):
+            call_command('gc_recipe_images', stdout=StringIO())
+
+        self.assertTrue(RecipeImageBlob.objects.filter(id=unused.id).exists())
+
+    def test_sweep_orphaned_files(self):
+        """ Test --sweep deletes files no image refers to. """
+        used = self._blob('d' * 64, 1, timedelta(days=1))
+        orphan = default_storage.save(
+            'uploads/recipe/orphan.jpg', ContentFile(b'x'),
+        )
+
+        call_command(
+            'gc_recipe_images', '--sweep', '--grace-minutes=0',
+            stdout=StringIO(),
+        )
+
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(used.name))
+        self.assertTrue(
+            default_storage.exists(variant_name(used.name, 128, 'webp'))
+        )
@@ -0,0 +1,131 @@
+"""
+Tests for the database connection health checks and metrics
+"""
+import time
+from unittest.mock import Mock, patch
+
+from django.core.signals import request_started
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from core.connections import (
+    check_connections,
+    connection_stats,
+    count_created_connection,
+    reset_connection_stats,
+)
+
+
+def fake_connection(usable=True, last_used=None):
+    return Mock(
+        connection=object(), in_atomic_block=False, last_used=last_used,
+        **{'is_usable.return_value': usable},
+    )
+
+
+class CheckConnectionsTests(SimpleTestCase):
+    """ Test kept connections are checked when a request starts """
+
+    def setUp(self):
+        reset_connection_stats()
+        self.addCleanup(reset_connection_stats)
+
+    def _check(self, *conns):
+        with patch(
+            'core.connections.connections.all', return_value=list(conns),
+        ):
+            check_connections()
+
+    def test_unusable_connection_closed(self):
+        """ Test a connection failing the ping is closed before reuse """
+        conn = fake_connection(usable=False)
+
+        self._check(conn)
+
+        conn.close.assert_called_once_with()
+        self.assertEqual(connection_stats()['failed_checks'], 1)
+        self.assertEqual(connection_stats()['reused'], 0)
+
+    def test_usable_connection_reused(self):
+        """ Test a live connection is kept and counted as reused """
+        conn = fake_connection()
+        closed = Mock(connection=None)
+
+        self._check(conn, closed)
+        count_created_connection()
+
+        conn.close.assert_not_called()
+        closed.is_usable.assert_not_called()
+        stats = connection_stats()
+        self.assertEqual((stats['reused'], stats['opened']), (1, 1))
+        self.assertEqual(stats['reuse_rate'], 0.5)
+
+    def test_recently_used_connection_not_pinged(self):
+        """ Test a connection used within the idle period is not pinged """
+        conn = fake_connection(usable=False, last_used=time.monotonic())
+
+        self._check(conn)
+
+        conn.is_usable.assert_not_called()
+        self.assertEqual(connection_stats()['reused'], 1)
+
+    def test_unused_connection_pinged_once_per_idle_period(self):
+        """ Test a ping restarts the idle period of an unused connection """
+        conn = fake_connection()
+
+        self._check(conn)
+        self._check(conn)
+
+        conn.is_usable.assert_called_once_with()
+
+    @override_settings(DB_CONN_HEALTH_CHECKS=False)
+    def test_health_checks_disabled(self):
+        """ Test connections are not pinged when health checks are off """
+        conn = fake_connection(usable=False)
+
+        self._check(conn)
+
+        conn.is_usable.assert_not_called()
+        conn.close.assert_not_called()
+
+    @override_settings(DB_CONN_STATS_INTERVAL=2)
+    def test_reuse_rate_logged(self):
+        """ Test the reuse rate is logged every DB_CONN_STATS_INTERVAL uses """
+        with self.assertLogs('core.connections', 'INFO') as logs:
+            self._check(fake_connection())
+            count_created_connection()
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('1 reused, 1 opened (50.0% reuse)', logs.output[0])
+
+
+@override_settings(DB_CONN_STATS_INTERVAL=0)
+class PersistentConnectionTests(TransactionTestCase):
+    """ Test connections are kept between requests """
+
+    def setUp(self):
+        reset_connection_stats()
+        self.addCleanup(reset_connection_stats)
+
+    def test_connection_kept_between_requests(self):
+        """ Test a request reuses the connection of the previous one """
+        connection.ensure_connection()
+        kept = connection.connection
+
+        with patch.dict(connection.settings_dict, CONN_MAX_AGE=60):
+            connection.close_at = None
+            request_started.send(sender=self.__class__)
+
+        self.assertIs(connection.connection, kept)
+        self.assertEqual(connection_stats()['reused'], 1)
+
+    def test_query_records_connection_use(self):
+        """ Test running a query restarts the idle period of a connection """
+        connection.close()
+        connection.ensure_connection()
+        connection.last_used = 0
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+        self.assertGreater(connection.last_used, 0)
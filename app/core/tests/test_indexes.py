@@ -0,0 +1,95 @@
+"""
+Tests that per-user queries are served by the composite indexes.
+"""
+from decimal import Decimal
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+
+from core import models
+
+
+USERS = 20
+RECIPES_PER_USER = 200
+ATTRS_PER_USER = 50
+
+
+@skipUnless(
+    connection.vendor == 'postgresql', 'Index names are Postgres plans',
+)
+class IndexUsageTests(TestCase):
+    """ Check query plans on a seeded dataset. """
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [
+            get_user_model().objects.create_user(
+                f'user{i}@example.com', 'testpass',
+            )
+            for i in range(USERS)
+        ]
+        models.Recipe.objects.bulk_create([
+            models.Recipe(
+                user=user,
+                title=f'Recipe {i}',
+                time_minutes=i % 120,
+                price=Decimal(i % 50),
+            )
+            for user in users for i in range(RECIPES_PER_USER)
+        ])
+        for model in (models.Tag, models.Ingredient):
+            model.objects.bulk_create([
+                model(user=user, name=f'Name {i}')
+                for user in users for i in range(ATTRS_PER_USER)
+            ])
+        with connection.cursor() as cursor:
+            for model in (models.Recipe, models.Tag, models.Ingredient):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+        cls.user = users[0]
+
+    def assertUsesIndex(self, queryset, index_name):
+        """ Assert that the query plan scans the given index. """
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_recipe_list_uses_user_id_index(self):
+        """ Test listing a user's newest recipes uses (user_id, -id). """
+        queryset = models.Recipe.objects.filter(
+            user=self.user,
+        ).order_by('-id')[:25]
+
+        self.assertUsesIndex(queryset, 'recipe_user_id_desc_idx')
+
+    def test_recipe_time_range_uses_user_time_index(self):
+        """ Test a time range ordered by time uses recipe_user_time_idx. """
+        queryset = models.Recipe.objects.filter(
+            user=self.user, time_minutes__lte=30,
+        ).order_by('time_minutes', 'id')[:25]
+
+        self.assertUsesIndex(queryset, 'recipe_user_time_idx')
+
+    def test_recipe_price_range_uses_user_price_index(self):
+        """ Test a price range ordered by price uses (user_id, price, id). """
+        queryset = models.Recipe.objects.filter(
+            user=self.user, price__gte=Decimal('10'), price__lte=Decimal('20'),
+        ).order_by('-price', '-id')[:25]
+
+        self.assertUsesIndex(queryset, 'recipe_user_price_idx')
+
+    def test_tag_list_uses_user_name_index(self):
+        """ Test listing a user's tags by name uses (user_id, name). """
+        queryset = models.Tag.objects.filter(
+            user=self.user
+        ).order_by('-name', '-id')[:25]
+
+        self.assertUsesIndex(queryset, 'unique_tag_name_per_user')
+
+    def test_ingredient_lookup_by_name_uses_user_name_index(self):
+        """ Test resolving ingredient names uses (user_id, name). """
+        queryset = models.Ingredient.objects.filter(
+            user=self.user, name__in=['Name 1', 'Name 2'],
+        )
+
+        self.assertUsesIndex(queryset, 'unique_ingredient_name_per_user')
@@ -95,6 +95,24 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(ingredient), ingredient.name)
 
+    def test_get_or_create_tags_by_names(self):
+        """Test tags are fetched or created in bulk by name."""
+        user = create_user()
+        existing = models.Tag.objects.create(user=user, name='Vegan')
+        other_user = create_user(email='other@example.com')
+        models.Tag.objects.create(user=other_user, name='Dessert')
+
+        # Select existing, insert missing, select the inserted rows.
+        with self.assertNumQueries(3):
+            tags = models.Tag.objects.get_or_create_by_names(
+                user, ['Vegan', 'Dessert', 'Dessert'],
+            )
+
+        self.assertEqual(set(tags), {'Vegan', 'Dessert'})
+        self.assertEqual(tags['Vegan'], existing)
+        self.assertEqual(tags['Dessert'].user, user)
+        self.assertEqual(models.Tag.objects.filter(user=user).count(), 2)
+
     @patch('core.models.uuid.uuid4')
     def test_recipe_file_name_uuid(self, mock_uuid):
         """Test that image is saved in the correct location."""
@@ -0,0 +1,72 @@
+"""
+Async entry points for the hot read paths of the recipe API
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+
+from django.db import close_old_connections
+from django.urls import URLPattern
+
+from rest_framework.permissions import SAFE_METHODS
+
+from core.connections import check_connections
+
+
+# URL names of the routes served through async_view under ASGI: the
+# recipe list and detail and the tag and ingredient lists.
+ASYNC_READ_ROUTES = (
+    'recipe-list', 'recipe-detail', 'tag-list', 'ingredient-list',
+)
+
+
+def _run_read(view, request, *args, **kwargs):
+    """ Run a read request on a pool thread with its own connection """
+    # The request_started/finished handlers only see the connection of the
+    # shared thread, so connections of pool threads are recycled here.
+    close_old_connections()
+    check_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            # Not left to the handler, which renders on the shared thread.
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_view(view):
+    """ Wrap a sync view so safe requests run concurrently under ASGI
+
+    Django 3.2 runs every sync view of a process on one shared thread, so a
+    slow query holds up all other requests of that worker. GET, HEAD and
+    OPTIONS requests are run on the event loop's thread pool instead, each
+    thread with its own database connection. Writes keep running on the
+    shared thread.
+    """
+    read = sync_to_async(
+        functools.partial(_run_read, view), thread_sensitive=False,
+    )
+    write = sync_to_async(view, thread_sensitive=True)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return await read(request, *args, **kwargs)
+        return await write(request, *args, **kwargs)
+
+    return wrapper
+
+
+def async_read_views(patterns, names=ASYNC_READ_ROUTES):
+    """ Return patterns with the views of the named routes made async """
+    return [
+        URLPattern(
+            pattern.pattern, async_view(pattern.callback),
+            pattern.default_args, pattern.name,
+        )
+        if isinstance(pattern, URLPattern) and pattern.name in names
+        else pattern
+        for pattern in patterns
+    ]
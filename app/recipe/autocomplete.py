@@ -0,0 +1,91 @@
+"""
+In-process prefix trees for tag and ingredient autocomplete
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from recipe.cache import get_user_version
+
+
+class _Node:
+    __slots__ = ('children', 'completions')
+
+    def __init__(self):
+        self.children = {}
+        self.completions = []
+
+
+class NameTrie:
+    """ Prefix tree over object names
+
+    Every node keeps the first limit objects below it, in the order of
+    RecipeAttrQuerySet.starting_with, so a lookup only walks the prefix.
+    """
+
+    def __init__(self, objs, limit):
+        self.limit = limit
+        self.root = _Node()
+        for obj in sorted(objs, key=lambda obj: (obj.name.lower(), obj.id)):
+            node = self.root
+            # Upper case like the istartswith lookup.
+            for char in obj.name.upper():
+                node = node.children.setdefault(char, _Node())
+                if len(node.completions) < limit:
+                    node.completions.append(obj)
+
+    def starting_with(self, text):
+        """ Return the first objects whose name starts with text """
+        node = self.root
+        for char in text.upper():
+            node = node.children.get(char)
+            if node is None:
+                return []
+
+        return list(node.completions)
+
+
+# (basename, user id) -> [cache version, lookups, trie or None], least
+# recently used first.
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_user_trie(basename, user, queryset):
+    """ Return the trie of the user's names, or None if not hot enough yet
+
+    Tries are rebuilt after invalidate_user_cache bumps the user's cache
+    version, and only the most recently used users keep one.
+    """
+    if not settings.AUTOCOMPLETE_TRIE_USERS:
+        return None
+
+    version = get_user_version(user.pk)
+    key = (basename, user.pk)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry[0] != version:
+            entry = [version, 0, None]
+            _entries[key] = entry
+        _entries.move_to_end(key)
+        entry[1] += 1
+        while len(_entries) > settings.AUTOCOMPLETE_TRIE_USERS:
+            _entries.popitem(last=False)
+        if (
+            entry[2] is not None
+            or entry[1] < settings.AUTOCOMPLETE_TRIE_MIN_REQUESTS
+        ):
+            return entry[2]
+
+    # Built outside the lock, a concurrent build for the same user is
+    # merely wasted work.
+    trie = NameTrie(queryset.only('id', 'name'), settings.AUTOCOMPLETE_LIMIT)
+    entry[2] = trie
+    return trie
+
+
+def clear_tries():
+    """ Drop all tries of this process """
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,149 @@
+"""
+Per-user caching of the recipe list responses and conditional GETs
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Max, Value
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import salted_hmac
+from django.utils.http import parse_etags
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.models import Recipe, Tag, Ingredient
+
+
+def _cache():
+    """ Return the cache backend used for recipe lists """
+    return caches[settings.RECIPE_CACHE_ALIAS]
+
+
+def _version_key(user_id):
+    return f'recipe:version:{user_id}'
+
+
+def get_user_version(user_id):
+    """ Return the current cache version of a user's recipe data """
+    cache = _cache()
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a counter that was evicted can never come
+        # back at a value an older cached entry was stored under.
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+
+    return version
+
+
+def invalidate_user_cache(user):
+    """ Drop every cached list of the user by bumping their version """
+    cache = _cache()
+    key = _version_key(user.pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+# Query params holding comma separated ids, '2,1' and '1,2' select the
+# same tags and ingredients.
+ID_LIST_PARAMS = ('tags', 'ingredients')
+
+
+def _request_fingerprint(request):
+    """ Return the URL of the request with normalized query params """
+    params = []
+    for name in sorted(request.query_params):
+        for value in request.query_params.getlist(name):
+            if name in ID_LIST_PARAMS:
+                value = ','.join(sorted(value.split(',')))
+            params.append((name, value))
+
+    return f'{request.build_absolute_uri(request.path)}?{urlencode(params)}'
+
+
+def list_cache_key(request, basename):
+    """ Return the cache key for a list request of the authenticated user """
+    digest = hashlib.sha1(_request_fingerprint(request).encode()).hexdigest()
+    version = get_user_version(request.user.pk)
+
+    return f'recipe:list:{request.user.pk}:{version}:{basename}:{digest}'
+
+
+class CachedListMixin:
+    """ Serve list responses from the per-user cache """
+
+    def list(self, request, *args, **kwargs):
+        cache = _cache()
+        key = list_cache_key(request, self.basename)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = super().list(request, *args, **kwargs)
+        cache.set(key, response.data, settings.RECIPE_LIST_CACHE_TIMEOUT)
+        return response
+
+
+def user_data_state(user):
+    """ Return when and how the user's recipes, tags and ingredients changed
+
+    A single UNION ALL query of the latest updated_at and the row count per
+    model. Counts catch deletes, which leave no newer updated_at behind.
+    """
+    querysets = [
+        model.objects.filter(user=user).values('user').annotate(
+            kind=Value(model._meta.model_name),
+            changed=Max('updated_at'),
+            total=Count('id'),
+        ).values_list('kind', 'changed', 'total')
+        for model in (Recipe, Tag, Ingredient)
+    ]
+    rows = querysets[0].union(*querysets[1:], all=True)
+
+    return sorted(
+        (kind, changed.isoformat(), total) for kind, changed, total in rows
+    )
+
+
+class ConditionalGetMixin:
+    """ Emit ETags and answer a matching If-None-Match with 304
+
+    The ETag is derived from the request and the user's data state, so a
+    304 is returned before anything is fetched or serialized.
+    """
+
+    def get_etag(self, request):
+        """ Return a strong ETag for the response to this request """
+        value = '|'.join([
+            str(request.user.pk),
+            _request_fingerprint(request),
+            request.META.get('HTTP_ACCEPT', ''),
+            repr(user_data_state(request.user)),
+        ])
+        return f'"{salted_hmac("recipe.etag", value).hexdigest()}"'
+
+    def conditional_get(self, handler, request, *args, **kwargs):
+        """ Run the handler unless the client already has the response """
+        etag = self.get_etag(request)
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (
+            status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED,
+        ):
+            response['ETag'] = etag
+            patch_vary_headers(response, ('Authorization',))
+
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_get(super().list, request, *args, **kwargs)
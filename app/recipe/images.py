@@ -0,0 +1,214 @@
+"""
+Background processing of uploaded recipe images
+"""
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import (
+    Recipe, RecipeImageBlob, RecipeImageJob, recipe_image_blob_path,
+)
+from recipe.cache import invalidate_user_cache
+
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+_executor = None
+
+
+def variant_name(image_name, size, fmt):
+    """ Return the storage name of a resized variant of an image """
+    stem = os.path.splitext(image_name)[0]
+    return f'{stem}_{size}.{fmt}'
+
+
+def get_variant(image_name, size, fmt):
+    """ Return the name of a variant of an image, made on first use """
+    name = variant_name(image_name, size, fmt)
+    if default_storage.exists(name):
+        return name
+
+    with default_storage.open(image_name, 'rb') as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    saved = default_storage.save(
+        name, _encode(image, size, VARIANT_FORMATS[fmt]),
+    )
+    if saved != name:
+        # Generated concurrently by another request, keep theirs.
+        default_storage.delete(saved)
+
+    return name
+
+
+def delete_image_files(image_name):
+    """ Delete an image and all of its variants from storage """
+    if not image_name:
+        return
+    names = [image_name] + [
+        variant_name(image_name, size, fmt)
+        for size in settings.RECIPE_IMAGE_SIZES
+        for fmt in VARIANT_FORMATS
+    ]
+    for name in names:
+        default_storage.delete(name)
+
+
+def file_digest(file):
+    """ Return the SHA-256 digest of a file, read in chunks """
+    hasher = hashlib.sha256()
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _replace(name, content):
+    """ Save content under exactly name, over any leftover of a failed run """
+    default_storage.delete(name)
+    default_storage.save(name, content)
+
+
+def _store_image(source, name):
+    """ Decode source once and store it under name with its variants """
+    image = Image.open(source)
+    if image.width * image.height > settings.RECIPE_IMAGE_MAX_PIXELS:
+        raise ValueError(f'Image is {image.width}x{image.height} pixels.')
+    # Apply the EXIF orientation before the metadata is dropped.
+    image = ImageOps.exif_transpose(image).convert('RGB')
+
+    for size in settings.RECIPE_IMAGE_SIZES:
+        for fmt, image_format in VARIANT_FORMATS.items():
+            _replace(
+                variant_name(name, size, fmt),
+                _encode(image, size, image_format),
+            )
+    # Written last, so an existing image means its variants exist too.
+    _replace(name, _encode(image, settings.RECIPE_IMAGE_MAX_SIZE, 'JPEG'))
+
+
+def _encode(image, size, image_format):
+    """ Return image scaled down to fit size x size, encoded """
+    image = image.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    # No exif argument is passed, so the metadata is not written back.
+    image.save(
+        buffer, format=image_format, quality=settings.RECIPE_IMAGE_QUALITY,
+    )
+    return ContentFile(buffer.getvalue())
+
+
+def _lock_blob(digest):
+    """ Return the blob of digest, created if needed, locked until commit """
+    blob, _ = RecipeImageBlob.objects.select_for_update().get_or_create(
+        digest=digest, defaults={'name': recipe_image_blob_path(digest)},
+    )
+    return blob
+
+
+def process_image_job(job_id):
+    """ Store an uploaded image and its variants once per distinct content
+
+    Uploads are keyed by their SHA-256 digest, a recipe given an image that
+    was already processed shares the stored files instead of decoding it
+    again. The image the recipe held before loses a reference, and is
+    removed by gc_recipe_images once no recipe uses it.
+    """
+    claimed = RecipeImageJob.objects.filter(
+        id=job_id, status=RecipeImageJob.PENDING,
+    ).update(status=RecipeImageJob.PROCESSING, updated_at=timezone.now())
+    if not claimed:
+        # Already taken by another worker.
+        return
+
+    job = RecipeImageJob.objects.get(id=job_id)
+    status, message = RecipeImageJob.DONE, ''
+    try:
+        with job.source.open('rb') as source:
+            digest = job.digest or file_digest(source)
+            with transaction.atomic():
+                # Touched so gc_recipe_images leaves it alone for its grace
+                # period while the image is stored below, without the lock.
+                blob = _lock_blob(digest)
+                RecipeImageBlob.objects.filter(id=blob.id).update(
+                    updated_at=timezone.now(),
+                )
+            if not default_storage.exists(blob.name):
+                source.seek(0)
+                _store_image(source, blob.name)
+            with transaction.atomic():
+                # Locked and read again, so concurrent jobs of the recipe
+                # each release the image the previous one stored.
+                recipe = Recipe.objects.select_for_update().get(
+                    pk=job.recipe_id,
+                )
+                blob = _lock_blob(digest)
+                if not default_storage.exists(blob.name):
+                    # Collected in between, only with a shorter grace period
+                    # than the image took to store.
+                    source.seek(0)
+                    _store_image(source, blob.name)
+                RecipeImageBlob.objects.filter(id=blob.id).update(
+                    ref_count=F('ref_count') + 1, updated_at=timezone.now(),
+                )
+                RecipeImageBlob.objects.release(recipe.image.name)
+                recipe.image.name = blob.name
+                recipe.save(update_fields=['image', 'updated_at'])
+        invalidate_user_cache(recipe.user)
+    except Exception as error:
+        logger.exception('Processing image job %s failed', job_id)
+        status, message = RecipeImageJob.FAILED, str(error)
+
+    try:
+        job.source.delete(save=False)
+    except Exception:
+        logger.exception('Deleting the upload of image job %s failed', job_id)
+    # Updated in place, save() would insert the job again if its recipe
+    # was deleted in the meantime.
+    RecipeImageJob.objects.filter(id=job.id).update(
+        status=status, error=message, source=job.source.name or '',
+        updated_at=timezone.now(),
+    )
+
+
+def _run_in_worker(job_id):
+    """ Process a job on a pool thread and release its DB connection """
+    try:
+        process_image_job(job_id)
+    finally:
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # Created lazily so each forked uWSGI worker gets its own threads.
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.RECIPE_IMAGE_WORKERS,
+            thread_name_prefix='recipe-image',
+        )
+    return _executor
+
+
+def enqueue_image_job(job):
+    """ Process the job in the background once the upload is committed """
+    def submit():
+        if settings.RECIPE_IMAGE_PROCESSING_EAGER:
+            process_image_job(job.id)
+        else:
+            _get_executor().submit(_run_in_worker, job.id)
+
+    transaction.on_commit(submit)
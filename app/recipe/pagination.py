@@ -0,0 +1,25 @@
+"""
+Pagination for the recipe APIs
+"""
+from django.conf import settings
+
+from rest_framework.pagination import CursorPagination
+
+
+class RecipeCursorPagination(CursorPagination):
+    """ Keyset pagination for recipes, newest first """
+    # The cursor encodes the last seen position, so every page is a
+    # WHERE ... < position LIMIT n query rather than an OFFSET scan.
+    ordering = ('-id',)
+    page_size = settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        """ Follow the ordering of the view queryset, e.g. search rank """
+        return tuple(queryset.query.order_by) or self.ordering
+
+
+class RecipeAttrCursorPagination(RecipeCursorPagination):
+    """ Keyset pagination for tags and ingredients """
+    ordering = ('-name', '-id')
@@ -0,0 +1,16 @@
+"""
+Renderers for the recipe APIs
+"""
+from rest_framework import renderers
+
+
+class NDJSONRenderer(renderers.JSONRenderer):
+    """ Newline delimited JSON, one object per line """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Streaming views write their own lines, this only renders the
+        # single object of an error response.
+        rendered = super().render(data, accepted_media_type, renderer_context)
+        return rendered + b'\n'
@@ -0,0 +1,37 @@
+"""
+Read replica routing for the recipe views
+"""
+from rest_framework.permissions import SAFE_METHODS
+
+from core.routers import (
+    end_replica_reads,
+    is_pinned,
+    pin_to_primary,
+    start_replica_reads,
+)
+
+
+class ReplicaReadMixin:
+    """ Serve safe requests from a read replica, writes pin to the primary
+
+    The user is authenticated against the primary first, so a revoked
+    token is never accepted from a lagging replica. After a write the user
+    reads from the primary for READ_REPLICA_PIN_SECONDS, so they see their
+    own changes.
+    """
+
+    _replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in SAFE_METHODS:
+            pin_to_primary(request.user)
+        elif not is_pinned(request.user):
+            self._replica_token = start_replica_reads()
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            end_replica_reads(self._replica_token)
+            self._replica_token = None
@@ -1,13 +1,19 @@
 """
 Serializers for recipe APIs
 """
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+
 from rest_framework import serializers
 
 from core.models import (
     Recipe,
+    RecipeImageJob,
     Tag,
     Ingredient,
 )
+from recipe.images import VARIANT_FORMATS
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -19,6 +25,14 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class IngredientCountSerializer(IngredientSerializer):
+    """ Serializer for ingredients with the number of recipes using them """
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(IngredientSerializer.Meta):
+        fields = IngredientSerializer.Meta.fields + ('recipe_count',)
+
+
 class TagSerializer(serializers.ModelSerializer):
     """ Serializer for tag objects """
 
@@ -27,37 +41,193 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name')
         read_only_fields = ('id',)
 
+
+class TagCountSerializer(TagSerializer):
+    """ Serializer for tags with the number of recipes using them """
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ('recipe_count',)
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """ Create and update many recipes with a fixed number of queries """
+
+    def _resolve_names(self, validated_data):
+        """ Get or create the tags and ingredients of every item at once """
+        auth_user = self.context['request'].user
+        tags = Tag.objects.get_or_create_by_names(auth_user, [
+            tag['name']
+            for item in validated_data
+            for tag in item.get('tags', [])
+        ])
+        ingredients = Ingredient.objects.get_or_create_by_names(auth_user, [
+            ingredient['name']
+            for item in validated_data
+            for ingredient in item.get('ingredients', [])
+        ])
+        return tags, ingredients
+
+    def _through(self, field_name):
+        """ Return the through model of field_name and its related column """
+        field = Recipe._meta.get_field(field_name)
+        column = f'{field.m2m_reverse_field_name()}_id'
+        return field.remote_field.through, column
+
+    def _link(self, recipes, items, field_name, objs):
+        """ Insert the through rows of every recipe in one query """
+        through, column = self._through(field_name)
+        through.objects.bulk_create([
+            through(recipe_id=recipe.id, **{column: obj_id})
+            for recipe, item in zip(recipes, items)
+            for obj_id in {
+                objs[related['name']].id for related in item[field_name]
+            }
+        ])
+
+    def _relink(self, recipes, items, field_name, objs):
+        """ Replace the through rows of the recipes given field_name
+
+        The current rows are read once, and only the rows that changed
+        are deleted and inserted, like set() but for every recipe at once.
+        """
+        changed = [
+            (recipe, item) for recipe, item in zip(recipes, items)
+            if field_name in item
+        ]
+        if not changed:
+            return
+        through, column = self._through(field_name)
+        current = {
+            (recipe_id, obj_id): link_id
+            for link_id, recipe_id, obj_id in through.objects.filter(
+                recipe_id__in=[recipe.id for recipe, _ in changed],
+            ).values_list('id', 'recipe_id', column)
+        }
+        wanted = {
+            (recipe.id, objs[related['name']].id)
+            for recipe, item in changed
+            for related in item[field_name]
+        }
+        stale = [
+            link_id for link, link_id in current.items() if link not in wanted
+        ]
+        if stale:
+            through.objects.filter(id__in=stale).delete()
+        through.objects.bulk_create([
+            through(recipe_id=recipe_id, **{column: obj_id})
+            for recipe_id, obj_id in wanted - current.keys()
+        ])
+
+    def _fetch(self, recipes):
+        """ Reload the recipes with their tags and ingredients prefetched """
+        return list(Recipe.objects.filter(
+            id__in=[recipe.id for recipe in recipes],
+        ).prefetch_related('tags', 'ingredients').order_by('id'))
+
+    def create(self, validated_data):
+        """ Create the recipes and their relations in bulk """
+        tags, ingredients = self._resolve_names(validated_data)
+        items = [
+            {
+                'tags': item.pop('tags', []),
+                'ingredients': item.pop('ingredients', []),
+            }
+            for item in validated_data
+        ]
+        recipes = Recipe.objects.bulk_create_with_ids(
+            [Recipe(**item) for item in validated_data]
+        )
+        self._link(recipes, items, 'tags', tags)
+        self._link(recipes, items, 'ingredients', ingredients)
+
+        return self._fetch(recipes)
+
+    def update(self, instances, validated_data):
+        """ Update the recipes, matched by position, in bulk """
+        tags, ingredients = self._resolve_names(validated_data)
+        items = [
+            {
+                field_name: item.pop(field_name)
+                for field_name in ('tags', 'ingredients')
+                if field_name in item
+            }
+            for item in validated_data
+        ]
+        self._relink(instances, items, 'tags', tags)
+        self._relink(instances, items, 'ingredients', ingredients)
+
+        fields = {'updated_at'}
+        now = timezone.now()
+        for recipe, item in zip(instances, validated_data):
+            for attr, value in item.items():
+                setattr(recipe, attr, value)
+                fields.add(attr)
+            recipe.updated_at = now
+        Recipe.objects.bulk_update(instances, fields)
+
+        return self._fetch(instances)
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """ Serializer for recipe objects """
     tags = TagSerializer(many=True, required=False)
     ingredients = IngredientSerializer(many=True, required=False)
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'title', 'time_minutes', 'price', 'link', 'tags', 'ingredients')
+        fields = (
+            'id', 'title', 'time_minutes', 'price', 'link', 'tags',
+            'ingredients', 'thumbnails',
+        )
         read_only_fields = ('id',)
+        list_serializer_class = RecipeListSerializer
+
+    def _thumbnail_url(self, recipe, size, fmt):
+        """ Return the URL redirecting to a rendition, generated on first use
+
+        Storage is not checked here, that would cost a round trip per
+        rendition of every listed recipe.
+        """
+        url = reverse('recipe:recipe-thumbnail', args=[recipe.id, size, fmt])
+        request = self.context.get('request')
+
+        return request.build_absolute_uri(url) if request else url
+
+    def get_thumbnails(self, recipe):
+        """ Map each thumbnail size to its WebP and JPEG URLs """
+        if not recipe.image:
+            return None
+
+        return {
+            str(size): {
+                fmt: self._thumbnail_url(recipe, size, fmt)
+                for fmt in VARIANT_FORMATS
+            }
+            for size in settings.RECIPE_IMAGE_SIZES
+        }
 
-    def _get_or_create_tags(self, tags, recipe):
+    def _get_or_create_tags(self, tags):
         """ Handle geting or creating tags as need """
         auth_user = self.context['request'].user
-        for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(user=auth_user, **tag)
-            recipe.tags.add(tag_obj)
+        return Tag.objects.get_or_create_by_names(
+            auth_user, [tag['name'] for tag in tags]
+        ).values()
 
-    def _get_or_create_ingredients(self, ingredients, recipe):
+    def _get_or_create_ingredients(self, ingredients):
         """ Handle geting or creating ingredients as need """
         auth_user = self.context['request'].user
-        for ingredient in ingredients:
-            ingredient_obj, created = Ingredient.objects.get_or_create(user=auth_user, **ingredient)
-            recipe.ingredients.add(ingredient_obj)
+        return Ingredient.objects.get_or_create_by_names(
+            auth_user, [ingredient['name'] for ingredient in ingredients]
+        ).values()
 
     def create(self, validated_data):
         """ Create a new recipe """
         tags = validated_data.pop('tags', [])
         ingredients = validated_data.pop('ingredients', [])
         recipe = Recipe.objects.create(**validated_data)
-        self._get_or_create_tags(tags, recipe)
-        self._get_or_create_ingredients(ingredients, recipe)
+        recipe.tags.add(*self._get_or_create_tags(tags))
+        recipe.ingredients.add(*self._get_or_create_ingredients(ingredients))
 
         return recipe
 
@@ -65,12 +235,13 @@ class RecipeSerializer(serializers.ModelSerializer):
         """ Update a recipe """
         tags = validated_data.pop('tags', None)
         ingredients = validated_data.pop('ingredients', None)
+        # set() only deletes and inserts the through rows that changed.
         if tags is not None:
-            instance.tags.clear()
-            self._get_or_create_tags(tags, instance)
+            instance.tags.set(self._get_or_create_tags(tags))
         if ingredients is not None:
-            instance.ingredients.clear()
-            self._get_or_create_ingredients(ingredients, instance)
+            instance.ingredients.set(
+                self._get_or_create_ingredients(ingredients)
+            )
 
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
@@ -83,17 +254,59 @@ class RecipeDetailSerializer(RecipeSerializer):
 
     class Meta(RecipeSerializer.Meta):
         fields = RecipeSerializer.Meta.fields + ('description', 'image')
-        read_only_fields = ('id',)
+        # Images only arrive through upload-image, which dedups and cleans
+        # them up.
+        read_only_fields = ('id', 'image')
 
 
  # Implement image API
 class RecipeImageSerializer(serializers.ModelSerializer):
-    """ Serializer for uploading images to recipes """
+    """ Serializer for uploading recipe images and their processing state """
+    image = serializers.ImageField(source='source', write_only=True)
+    recipe_image = serializers.ImageField(
+        source='recipe.image', read_only=True,
+    )
 
     class Meta:
-        model = Recipe
-        fields = ('id', 'image')
-        read_only_fields = ('id',)
-        extra_kwargs = {
-            'image': {'required': True},
-        }
+        model = RecipeImageJob
+        fields = (
+            'id', 'image', 'status', 'error', 'recipe_image',
+            'created_at', 'updated_at',
+        )
+        read_only_fields = (
+            'id', 'status', 'error', 'created_at', 'updated_at',
+        )
+
+    def create(self, validated_data):
+        """ Create an image job, keeping the digest taken while uploading """
+        source = validated_data['source']
+        validated_data['digest'] = getattr(source, 'digest', '')
+        return super().create(validated_data)
+
+
+class RecipeFilterSerializer(serializers.Serializer):
+    """ Serializer validating the range and ordering params of recipe lists """
+    ORDERING_CHOICES = (
+        'id', '-id', 'time_minutes', '-time_minutes', 'price', '-price',
+    )
+
+    min_time = serializers.IntegerField(min_value=0, required=False)
+    max_time = serializers.IntegerField(min_value=0, required=False)
+    min_price = serializers.DecimalField(
+        max_digits=None, decimal_places=2, min_value=0, required=False,
+    )
+    max_price = serializers.DecimalField(
+        max_digits=None, decimal_places=2, min_value=0, required=False,
+    )
+    ordering = serializers.ChoiceField(
+        choices=ORDERING_CHOICES, required=False,
+    )
+
+    def validate(self, attrs):
+        for name in ('time', 'price'):
+            low, high = attrs.get(f'min_{name}'), attrs.get(f'max_{name}')
+            if low is not None and high is not None and low > high:
+                raise serializers.ValidationError(
+                    {f'max_{name}': [f'Must not be less than min_{name}.']}
+                )
+        return attrs
@@ -0,0 +1,101 @@
+"""
+Tests for the async read views
+"""
+import asyncio
+import threading
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase
+
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.models import Recipe
+from recipe import views
+from recipe.async_views import async_read_views, async_view
+from recipe.urls import router
+
+
+class AsyncViewTests(TransactionTestCase):
+    """ Test sync views wrapped for ASGI """
+
+    def setUp(self):
+        cache.clear()
+        # Pool threads must not keep their connections past the test.
+        conn_max_age = patch.dict(connection.settings_dict, CONN_MAX_AGE=0)
+        conn_max_age.start()
+        self.addCleanup(conn_max_age.stop)
+        self.user = get_user_model().objects.create_user(
+            'user@example.com', 'testpass123',
+        )
+        self.factory = APIRequestFactory()
+        self.view = async_view(
+            views.RecipeViewSet.as_view({'get': 'list', 'post': 'create'})
+        )
+
+    def _call(self, request):
+        force_authenticate(request, self.user)
+        return async_to_sync(self.view)(request)
+
+    def test_wrapped_view_is_async(self):
+        """ Test the wrapper is a coroutine function with DRF's attributes """
+        self.assertTrue(asyncio.iscoroutinefunction(self.view))
+        self.assertTrue(self.view.csrf_exempt)
+        self.assertIs(self.view.cls, views.RecipeViewSet)
+
+    def test_read_runs_on_pool_thread(self):
+        """ Test reads run outside the shared thread, rendered """
+        Recipe.objects.create(
+            user=self.user, title='Curry', time_minutes=5, price='1.00',
+        )
+        list_recipes = views.RecipeViewSet.list
+        threads = []
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return list_recipes(*args, **kwargs)
+
+        with patch.object(views.RecipeViewSet, 'list', record_thread):
+            res = self._call(self.factory.get('/'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.is_rendered)
+        self.assertEqual([r['title'] for r in res.data['results']], ['Curry'])
+        self.assertIsNot(threads[0], threading.main_thread())
+
+    def test_write_runs_on_shared_thread(self):
+        """ Test writes keep running on the thread sensitive executor """
+        create = views.RecipeViewSet.create
+        threads = []
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return create(*args, **kwargs)
+
+        payload = {'title': 'Curry', 'time_minutes': 5, 'price': '1.00'}
+        with patch.object(views.RecipeViewSet, 'create', record_thread):
+            res = self._call(self.factory.post('/', payload, format='json'))
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertIs(threads[0], threading.main_thread())
+        self.assertTrue(Recipe.objects.filter(user=self.user).exists())
+
+    def test_async_read_views_wraps_read_routes(self):
+        """ Test only the hot read routes are made async """
+        patterns = async_read_views(router.urls)
+
+        wrapped = {
+            pattern.name
+            for pattern in patterns
+            if asyncio.iscoroutinefunction(pattern.callback)
+        }
+        self.assertEqual(
+            wrapped,
+            {'recipe-list', 'recipe-detail', 'tag-list', 'ingredient-list'},
+        )
+        self.assertEqual(len(patterns), len(router.urls))
@@ -0,0 +1,38 @@
+"""
+Tests for the autocomplete prefix trees.
+"""
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from recipe.autocomplete import NameTrie
+
+
+def items(*names):
+    return [SimpleNamespace(id=i, name=name) for i, name in enumerate(names)]
+
+
+class NameTrieTests(SimpleTestCase):
+    """ Test prefix lookups in the trie """
+
+    def test_starting_with_ignores_case(self):
+        """ Test lookups match any case, ordered by name """
+        trie = NameTrie(items('salt', 'Sage', 'SALSA', 'pepper'), limit=10)
+
+        names = [obj.name for obj in trie.starting_with('sa')]
+
+        self.assertEqual(names, ['Sage', 'SALSA', 'salt'])
+
+    def test_starting_with_is_limited(self):
+        """ Test at most limit objects are returned """
+        trie = NameTrie(items('a1', 'a2', 'a3'), limit=2)
+
+        self.assertEqual(
+            [obj.name for obj in trie.starting_with('a')], ['a1', 'a2'],
+        )
+
+    def test_no_match(self):
+        """ Test an unknown prefix returns nothing """
+        trie = NameTrie(items('salt'), limit=10)
+
+        self.assertEqual(trie.starting_with('x'), [])
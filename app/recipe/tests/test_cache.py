@@ -0,0 +1,208 @@
+"""
+Tests for the per-user list response cache
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.urls import reverse
+from django.test import TestCase
+
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.models import Recipe, Tag
+from recipe.cache import _request_fingerprint
+
+
+RECIPE_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def create_user(email='user@example.com', password='testpass'):
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+def create_recipe(user, **params):
+    """ Create and return a sample recipe """
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': Decimal('5.00'),
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class ListCacheTests(TestCase):
+    """ Test list responses are cached per user and invalidated on writes """
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_repeated_list_served_from_cache(self):
+        """ Test a repeated list request does not query the recipes """
+        create_recipe(user=self.user)
+        first = self.client.get(RECIPE_URL)
+
+        # Only the ETag state query runs, the list itself is cached.
+        with self.assertNumQueries(1):
+            second = self.client.get(RECIPE_URL)
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data, first.data)
+
+    def test_query_param_order_is_normalized(self):
+        """ Test equivalent tag filters share one cache entry """
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Dessert')
+        self.client.get(RECIPE_URL, {'tags': f'{tag1.id},{tag2.id}'})
+
+        # Only the ETag state query runs, the list itself is cached.
+        with self.assertNumQueries(1):
+            self.client.get(RECIPE_URL, {'tags': f'{tag2.id},{tag1.id}'})
+
+    def test_other_params_keep_their_order(self):
+        """ Test only the id list params are normalized """
+        def fingerprint(params):
+            request = APIRequestFactory().get(RECIPE_URL, params)
+            return _request_fingerprint(Request(request))
+
+        self.assertEqual(
+            fingerprint({'tags': '2,1', 'ingredients': '4,3'}),
+            fingerprint({'ingredients': '3,4', 'tags': '1,2'}),
+        )
+        self.assertNotEqual(
+            fingerprint({'search': 'lemon,tart'}),
+            fingerprint({'search': 'tart,lemon'}),
+        )
+        self.assertNotEqual(
+            fingerprint({'search': 'a&tags=1'}),
+            fingerprint({'search': 'a', 'tags': '1'}),
+        )
+
+    def test_create_recipe_invalidates_list(self):
+        """ Test creating a recipe through the API refreshes the list """
+        self.client.get(RECIPE_URL)
+
+        payload = {
+            'title': 'Chocolate cheesecake',
+            'time_minutes': 30,
+            'price': Decimal('5.99'),
+        }
+        self.client.post(RECIPE_URL, payload)
+        res = self.client.get(RECIPE_URL)
+
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_delete_recipe_invalidates_list(self):
+        """ Test deleting a recipe through the API refreshes the list """
+        recipe = create_recipe(user=self.user)
+        self.client.get(RECIPE_URL)
+
+        url = reverse('recipe:recipe-detail', args=[recipe.id])
+        self.client.delete(url)
+        res = self.client.get(RECIPE_URL)
+
+        self.assertEqual(res.data['results'], [])
+
+    def test_rename_tag_invalidates_recipe_and_tag_lists(self):
+        """ Test updating a tag refreshes the lists that embed it """
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(tag)
+        self.client.get(RECIPE_URL)
+        self.client.get(TAGS_URL)
+
+        url = reverse('recipe:tag-detail', args=[tag.id])
+        self.client.patch(url, {'name': 'Plant based'})
+        recipes = self.client.get(RECIPE_URL)
+        tags = self.client.get(TAGS_URL)
+
+        self.assertEqual(
+            recipes.data['results'][0]['tags'][0]['name'], 'Plant based'
+        )
+        self.assertEqual(tags.data['results'][0]['name'], 'Plant based')
+
+    def test_write_does_not_invalidate_other_users(self):
+        """ Test one user's writes keep other users' entries cached """
+        other_user = create_user(email='other@example.com')
+        other_client = APIClient()
+        other_client.force_authenticate(other_user)
+        create_recipe(user=other_user)
+        other_client.get(RECIPE_URL)
+
+        self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        # Only the ETag state query runs, the list itself is cached.
+        with self.assertNumQueries(1):
+            other_client.get(RECIPE_URL)
+
+
+class ConditionalGetTests(TestCase):
+    """ Test ETag and If-None-Match handling """
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_returns_etag(self):
+        """ Test list responses carry an ETag """
+        res = self.client.get(RECIPE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res['ETag'].startswith('"'))
+
+    def test_matching_etag_returns_not_modified(self):
+        """ Test a matching If-None-Match returns 304 without fetching data """
+        recipe = create_recipe(user=self.user)
+        url = reverse('recipe:recipe-detail', args=[recipe.id])
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+        self.assertFalse(res.content)
+
+    def test_etag_changes_after_update(self):
+        """ Test updating a recipe changes the ETag """
+        recipe = create_recipe(user=self.user)
+        url = reverse('recipe:recipe-detail', args=[recipe.id])
+        etag = self.client.get(url)['ETag']
+
+        self.client.patch(url, {'title': 'New title'})
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertEqual(res.data['title'], 'New title')
+
+    def test_etag_changes_after_tag_delete(self):
+        """ Test deleting a tag changes the ETag of the recipe list """
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        create_recipe(user=self.user).tags.add(tag)
+        etag = self.client.get(RECIPE_URL)['ETag']
+
+        self.client.delete(reverse('recipe:tag-detail', args=[tag.id]))
+        res = self.client.get(RECIPE_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'][0]['tags'], [])
+
+    def test_etag_differs_between_users(self):
+        """ Test the same URL has different ETags for different users """
+        etag = self.client.get(TAGS_URL)['ETag']
+
+        other_client = APIClient()
+        other_client.force_authenticate(create_user(email='other@example.com'))
+        res = other_client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
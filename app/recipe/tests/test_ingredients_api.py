@@ -3,8 +3,11 @@ Tests for ingredients API.
 """
 from decimal import Decimal
 
+from django.core.cache import cache
+from django.db import connection
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 
 from rest_framework import status
@@ -41,6 +44,7 @@ class PrivateIngredientsApiTests(TestCase):
     """ Test authenticated ingredients API requests """
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user = create_user()
         self.client.force_authenticate(self.user)
@@ -56,7 +60,7 @@ class PrivateIngredientsApiTests(TestCase):
         serializer = IngredientSerializer(ingredients, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
 
     def test_ingredients_limited_to_user(self):
@@ -70,9 +74,9 @@ class PrivateIngredientsApiTests(TestCase):
         res = self.client.get(INGREDIENTS_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['name'], ingredient.name)
-        self.assertEqual(res.data[0]['id'], ingredient.id)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['name'], ingredient.name)
+        self.assertEqual(res.data['results'][0]['id'], ingredient.id)
 
     def test_update_ingredient(self):
         """ Test updating an ingredient """
@@ -115,8 +119,65 @@ class PrivateIngredientsApiTests(TestCase):
         serializer1 = IngredientSerializer(ingredient1)
         serializer2 = IngredientSerializer(ingredient2)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
+
+    def _create_recipes_with(self, ingredient, count):
+        for i in range(count):
+            recipe = Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}',
+                time_minutes=5, price=Decimal('1.00'),
+            )
+            recipe.ingredients.add(ingredient)
+
+    @override_settings(RECIPE_LIST_CACHE_TIMEOUT=0)
+    def test_list_ingredients_with_counts(self):
+        """ Test with_counts=1 adds the number of recipes per ingredient """
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        self._create_recipes_with(salt, 2)
+        Ingredient.objects.create(user=self.user, name='Kale')
+
+        with CaptureQueriesContext(connection) as single:
+            res = self.client.get(INGREDIENTS_URL, {'with_counts': 1})
+
+        self.assertEqual(
+            [
+                (item['name'], item['recipe_count'])
+                for item in res.data['results']
+            ],
+            [('Salt', 2), ('Kale', 0)],
+        )
+        for i in range(5):
+            self._create_recipes_with(
+                Ingredient.objects.create(
+                    user=self.user, name=f'Ingredient {i}',
+                ),
+                1,
+            )
+        with CaptureQueriesContext(connection) as many:
+            res = self.client.get(INGREDIENTS_URL, {'with_counts': 1})
+        self.assertEqual(len(res.data['results']), 7)
+        self.assertEqual(len(many), len(single))
+
+    def test_assigned_ingredients_with_counts(self):
+        """ Test counts combined with assigned_only are not inflated """
+        eggs = Ingredient.objects.create(user=self.user, name='Eggs')
+        self._create_recipes_with(eggs, 3)
+        Ingredient.objects.create(user=self.user, name='Cheese')
+
+        res = self.client.get(
+            INGREDIENTS_URL, {'assigned_only': 1, 'with_counts': 1},
+        )
+
+        self.assertEqual(res.data['results'], [
+            {'id': eggs.id, 'name': 'Eggs', 'recipe_count': 3},
+        ])
+
+    def test_invalid_flag(self):
+        """ Test a flag other than 0 or 1 returns 400 """
+        res = self.client.get(INGREDIENTS_URL, {'with_counts': 'yes'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_filtered_ingredients_unique(self):
         """ Test that filtered ingredients are unique """
@@ -143,4 +204,4 @@ class PrivateIngredientsApiTests(TestCase):
         res = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
 
         # Check that only 1 ingredient is returned
-        self.assertEqual(len(res.data), 1)
+        self.assertEqual(len(res.data['results']), 1)
@@ -1,24 +1,46 @@
 '''
 Tests for the recipe API
 '''
+from datetime import timedelta
 from decimal import Decimal
+import hashlib
+import io
+import json
 import os
 import tempfile
+from unittest import skipUnless
+from unittest.mock import patch
 
 from PIL import Image
 
+from asgiref.sync import sync_to_async
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.urls import reverse
-from django.test import TestCase
+from django.utils import timezone
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Recipe, Tag, Ingredient
+from core.models import (
+    Recipe, RecipeImageBlob, RecipeImageJob, Tag, Ingredient,
+)
 
+from recipe import images
+from recipe.images import delete_image_files, process_image_job, variant_name
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe.uploads import BoundedImageUploadHandler, UploadTooLarge
+from user.authentication import issue_signed_token
 
 RECIPE_URL = reverse('recipe:recipe-list')
+BULK_URL = reverse('recipe:recipe-bulk')
+EXPORT_URL = reverse('recipe:recipe-export')
 
 def detail_url(recipe_id):
     """ Return recipe detail URL """
@@ -30,6 +52,11 @@ def image_upload_url(recipe_id):
     return reverse('recipe:recipe-upload-image', args=[recipe_id])
 
 
+def thumbnail_url(recipe_id, size, fmt):
+    """ Return URL generating a recipe thumbnail """
+    return reverse('recipe:recipe-thumbnail', args=[recipe_id, size, fmt])
+
+
 def create_recipe(user, **params):
     """ Create and return a sample recipe """
     defaults = {
@@ -63,6 +90,7 @@ class PrivateRecipeApiTests(TestCase):
     """ Test authenticated recipe API access """
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user = create_user(email="user@example.com", password="testpass")
         self.client.force_authenticate(self.user)
@@ -79,7 +107,7 @@ class PrivateRecipeApiTests(TestCase):
         # Pass all the recipe that we create to serializer
         serializer = RecipeSerializer(recipes, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_recipe_list_limited_to_user(self):
         """ Test List of recipes is limited to authenticatied user """
@@ -97,7 +125,7 @@ class PrivateRecipeApiTests(TestCase):
         recipes = Recipe.objects.filter(user=self.user)
         serializer = RecipeSerializer(recipes, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_get_recipe_detail(self):
         """ Test get a recipe detail """
@@ -296,6 +324,42 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(recipe.tags.count(), 0)
         self.assertFalse(recipe.tags.exists())
 
+    def _patch_tags_queries(self, tag_count):
+        """ Add one tag to a recipe with tag_count tags, return the queries """
+        recipe = create_recipe(user=self.user)
+        tags = [
+            Tag.objects.create(user=self.user, name=f'Tag {i}')
+            for i in range(tag_count)
+        ]
+        recipe.tags.add(*tags)
+
+        payload = {
+            'tags': [{'name': tag.name} for tag in tags] + [{'name': 'New'}]
+        }
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.patch(
+                detail_url(recipe.id), payload, format='json',
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(recipe.tags.count(), tag_count + 1)
+        Tag.objects.filter(user=self.user).delete()
+        return queries
+
+    def test_update_tags_only_writes_changed_rows(self):
+        """ Test updating tags does not rewrite unchanged through rows """
+        small = self._patch_tags_queries(2)
+        large = self._patch_tags_queries(20)
+
+        self.assertEqual(len(small), len(large))
+        through_table = Recipe.tags.through._meta.db_table
+        deletes = [
+            query for query in large.captured_queries
+            if query['sql'].startswith('DELETE')
+            and through_table in query['sql']
+        ]
+        self.assertEqual(deletes, [])
+
     def test_create_recipe_with_new_ingredients(self):
         """ Test creating a recipe with new ingredients. """
         payload = {
@@ -339,6 +403,37 @@ class PrivateRecipeApiTests(TestCase):
             exists = recipe.ingredients.filter(name=ingredient['name'], user=self.user).exists()
             self.assertTrue(exists)
 
+    def test_create_recipe_with_many_ingredients_query_count(self):
+        """ Test nested ingredients are created in a fixed query count """
+        Ingredient.objects.create(user=self.user, name='Ingredient 0')
+        payload = {
+            'title': 'Paella',
+            'time_minutes': 60,
+            'price': Decimal('12.00'),
+            'tags': [{'name': 'Spanish'}],
+            'ingredients': [
+                {'name': 'Ingredient 0'}, {'name': 'Ingredient 1'},
+            ],
+        }
+        with CaptureQueriesContext(connection) as few:
+            res = self.client.post(RECIPE_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        payload['tags'] = [{'name': 'Tapas'}]
+        payload['ingredients'] = [
+            {'name': f'Ingredient {i}'} for i in range(30)
+        ]
+        with CaptureQueriesContext(connection) as many:
+            res = self.client.post(RECIPE_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(many), len(few))
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(recipe.ingredients.count(), 30)
+        self.assertEqual(
+            Ingredient.objects.filter(user=self.user).count(), 30
+        )
+
     def test_create_ingredient_on_update(self):
         """ Test creating ingredient when updating a recipe """
         recipe = create_recipe(user=self.user)
@@ -403,9 +498,9 @@ class PrivateRecipeApiTests(TestCase):
         s1 = RecipeSerializer(r1)
         s2 = RecipeSerializer(r2)
         s3 = RecipeSerializer(r3)
-        self.assertIn(s1.data, res.data)
-        self.assertIn(s2.data, res.data)
-        self.assertNotIn(s3.data, res.data)
+        self.assertIn(s1.data, res.data['results'])
+        self.assertIn(s2.data, res.data['results'])
+        self.assertNotIn(s3.data, res.data['results'])
 
     def test_filter_by_ingredients(self):
         """ Test filtering recipes by ingredients """
@@ -423,15 +518,485 @@ class PrivateRecipeApiTests(TestCase):
         s1 = RecipeSerializer(r1)
         s2 = RecipeSerializer(r2)
         s3 = RecipeSerializer(r3)
-        self.assertIn(s1.data, res.data)
-        self.assertIn(s2.data, res.data)
-        self.assertNotIn(s3.data, res.data)
+        self.assertIn(s1.data, res.data['results'])
+        self.assertIn(s2.data, res.data['results'])
+        self.assertNotIn(s3.data, res.data['results'])
+
+    def test_filter_by_all_tags(self):
+        """ Test filtering recipes having all of the given tags """
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Dessert')
+        r1 = create_recipe(user=self.user, title='Vegan brownies')
+        r1.tags.add(tag1, tag2)
+        r2 = create_recipe(user=self.user, title='Vegan curry')
+        r2.tags.add(tag1)
+
+        params = {'tags': f'{tag1.id},{tag2.id}', 'match': 'all'}
+        res = self.client.get(RECIPE_URL, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        ids = [item['id'] for item in res.data['results']]
+        self.assertEqual(ids, [r1.id])
+
+    def test_filter_by_tags_returns_unique_recipes(self):
+        """ Test a recipe matching several tags is returned once """
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Dessert')
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(tag1, tag2)
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(RECIPE_URL, {'tags': f'{tag1.id},{tag2.id}'})
+
+        ids = [item['id'] for item in res.data['results']]
+        self.assertEqual(ids, [recipe.id])
+        self.assertNotIn('DISTINCT', queries.captured_queries[0]['sql'])
+
+    def test_filter_invalid_match_error(self):
+        """ Test an unknown match mode returns an error """
+        res = self.client.get(RECIPE_URL, {'tags': '1', 'match': 'some'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_by_time_and_price_range(self):
+        """ Test filtering recipes by time and price ranges """
+        quick_cheap = create_recipe(
+            user=self.user, time_minutes=10, price=Decimal('4.00'),
+        )
+        create_recipe(user=self.user, time_minutes=10, price=Decimal('12.00'))
+        create_recipe(user=self.user, time_minutes=45, price=Decimal('4.00'))
+        create_recipe(user=self.user, time_minutes=2, price=Decimal('1.00'))
+
+        res = self.client.get(RECIPE_URL, {
+            'min_time': 5, 'max_time': 30,
+            'min_price': '2', 'max_price': '10.00',
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['id'] for item in res.data['results']], [quick_cheap.id],
+        )
+
+    def test_invalid_filter_params(self):
+        """ Test invalid filter and ordering params return 400 """
+        for params, field in (
+            ({'max_time': 'soon'}, 'max_time'),
+            ({'min_price': '-1'}, 'min_price'),
+            ({'min_time': 30, 'max_time': 10}, 'max_time'),
+            ({'ordering': 'title'}, 'ordering'),
+            ({'tags': '1,x'}, 'tags'),
+        ):
+            res = self.client.get(RECIPE_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(field, res.data)
+
+    def test_order_by_price_paginated(self):
+        """ Test ordering by price pages through recipes in price order """
+        prices = ['3.00', '1.00', '2.00', '1.00', '5.00']
+        recipes = [
+            create_recipe(user=self.user, price=Decimal(price))
+            for price in prices
+        ]
+
+        res = self.client.get(
+            RECIPE_URL, {'ordering': '-price', 'page_size': 2},
+        )
+        ids = [item['id'] for item in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            ids.extend(item['id'] for item in res.data['results'])
+
+        expected = sorted(
+            recipes,
+            key=lambda recipe: (recipe.price, recipe.id),
+            reverse=True,
+        )
+        self.assertEqual(ids, [recipe.id for recipe in expected])
+
+    def test_list_recipes_paginated(self):
+        """ Test recipes are returned in cursor paginated pages """
+        recipes = [create_recipe(user=self.user) for _ in range(5)]
+
+        res = self.client.get(RECIPE_URL, {'page_size': 2})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        ids = [item['id'] for item in res.data['results']]
+        self.assertIsNone(res.data['previous'])
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(res.data['results']), 2)
+            ids.extend(item['id'] for item in res.data['results'])
+
+        expected = sorted((recipe.id for recipe in recipes), reverse=True)
+        self.assertEqual(ids, expected)
+
+    def test_search_recipes(self):
+        """ Test searching titles, descriptions, tags and ingredients """
+        by_title = create_recipe(user=self.user, title='Lemon tart')
+        by_description = create_recipe(
+            user=self.user, title='Pie', description='Zest of a lemon',
+        )
+        by_tag = create_recipe(user=self.user, title='Cake')
+        by_tag.tags.add(Tag.objects.create(user=self.user, name='Lemons'))
+        by_ingredient = create_recipe(user=self.user, title='Drink')
+        by_ingredient.ingredients.add(
+            Ingredient.objects.create(user=self.user, name='Lemon juice')
+        )
+        create_recipe(user=self.user, title='Pasta')
+        other_user = create_user(email='other@example.com')
+        create_recipe(user=other_user, title='Lemon')
+
+        res = self.client.get(RECIPE_URL, {'search': 'lemon'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        ids = [item['id'] for item in res.data['results']]
+        self.assertEqual(
+            set(ids),
+            {by_title.id, by_description.id, by_tag.id, by_ingredient.id},
+        )
+        if connection.vendor == 'postgresql':
+            # Title matches weigh most, description matches least.
+            self.assertEqual(ids[0], by_title.id)
+            self.assertEqual(ids[-1], by_description.id)
+
+    @override_settings(RECIPE_LIST_CACHE_TIMEOUT=0)
+    def test_search_follows_renamed_tag(self):
+        """ Test search results follow tag renames and removals """
+        recipe = create_recipe(user=self.user, title='Cake')
+        tag = Tag.objects.create(user=self.user, name='Chocolate')
+        recipe.tags.add(tag)
+
+        tag.name = 'Vanilla'
+        tag.save()
+        res = self.client.get(RECIPE_URL, {'search': 'vanilla'})
+        self.assertEqual(
+            [item['id'] for item in res.data['results']], [recipe.id],
+        )
+
+        recipe.tags.clear()
+        res = self.client.get(RECIPE_URL, {'search': 'vanilla'})
+        self.assertEqual(res.data['results'], [])
+
+    def test_search_paginated(self):
+        """ Test paging through search results returns each match once """
+        recipes = [
+            create_recipe(user=self.user, title='Soup') for _ in range(3)
+        ]
+        recipes += [
+            create_recipe(user=self.user, title='Tomato', description='Soup')
+            for _ in range(2)
+        ]
+
+        res = self.client.get(RECIPE_URL, {'search': 'soup', 'page_size': 2})
+        ids = [item['id'] for item in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            ids.extend(item['id'] for item in res.data['results'])
+
+        self.assertEqual(sorted(ids), sorted(recipe.id for recipe in recipes))
+
+    def _create_recipe_with_relations(self, index):
+        """ Create a recipe with its own tag and ingredient """
+        recipe = create_recipe(user=self.user, title=f'Recipe {index}')
+        recipe.tags.add(
+            Tag.objects.create(user=self.user, name=f'Tag {index}')
+        )
+        recipe.ingredients.add(
+            Ingredient.objects.create(
+                user=self.user, name=f'Ingredient {index}',
+            )
+        )
+        return recipe
+
+    @override_settings(RECIPE_LIST_CACHE_TIMEOUT=0)
+    def test_list_recipes_query_count_is_constant(self):
+        """ Test listing recipes does not run queries per recipe """
+        self._create_recipe_with_relations(0)
+        with CaptureQueriesContext(connection) as single:
+            res = self.client.get(RECIPE_URL)
+        self.assertEqual(len(res.data['results']), 1)
+
+        for index in range(1, 10):
+            self._create_recipe_with_relations(index)
+        with CaptureQueriesContext(connection) as many:
+            res = self.client.get(RECIPE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 10)
+        self.assertEqual(len(many), len(single))
+
+    def test_get_recipe_detail_query_count(self):
+        """ Test retrieving a recipe prefetches tags and ingredients """
+        recipe = self._create_recipe_with_relations(0)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Extra'))
+
+        # ETag state, recipe, tags and ingredients.
+        with self.assertNumQueries(4):
+            res = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['tags']), 2)
+
+
+class BulkRecipeApiTests(TestCase):
+    """ Test the bulk recipe API """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def _payload(self, count, prefix='Recipe'):
+        """ Return a list of recipe payloads sharing tags """
+        return [
+            {
+                'title': f'{prefix} {i}',
+                'time_minutes': 10 + i,
+                'price': '5.00',
+                'tags': [{'name': 'Dinner'}, {'name': f'{prefix} tag {i}'}],
+                'ingredients': [{'name': f'{prefix} salt'}],
+            }
+            for i in range(count)
+        ]
+
+    def test_bulk_create_recipes(self):
+        """ Test creating many recipes with shared tags in one request """
+        Tag.objects.create(user=self.user, name='Dinner')
+
+        res = self.client.post(BULK_URL, self._payload(3), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['title'] for item in res.data], [
+            'Recipe 0', 'Recipe 1', 'Recipe 2',
+        ])
+        recipes = Recipe.objects.filter(user=self.user)
+        self.assertEqual(recipes.count(), 3)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(Ingredient.objects.filter(user=self.user).count(), 1)
+        for recipe in recipes:
+            self.assertEqual(recipe.tags.count(), 2)
+            self.assertEqual(recipe.ingredients.count(), 1)
+
+    @skipUnless(
+        connection.features.can_return_rows_from_bulk_insert,
+        'Recipes are inserted one by one without RETURNING',
+    )
+    def test_bulk_create_query_count_is_constant(self):
+        """ Test the number of queries does not grow with the batch """
+        with CaptureQueriesContext(connection) as few:
+            self.client.post(
+                BULK_URL, self._payload(2, 'Small'), format='json',
+            )
+        with CaptureQueriesContext(connection) as many:
+            res = self.client.post(
+                BULK_URL, self._payload(50, 'Large'), format='json'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(many), len(few))
+
+    def test_bulk_create_reports_item_errors(self):
+        """ Test invalid items are reported by position, nothing is saved """
+        payload = self._payload(3)
+        del payload[1]['title']
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('title', res.data[1])
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+    def test_bulk_update_recipes(self):
+        """ Test partially updating many recipes """
+        r1 = create_recipe(user=self.user)
+        r2 = create_recipe(user=self.user)
+        r2.tags.add(Tag.objects.create(user=self.user, name='Old'))
+
+        payload = [
+            {'id': r1.id, 'title': 'First'},
+            {'id': r2.id, 'tags': [{'name': 'New'}]},
+        ]
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        r1.refresh_from_db()
+        r2.refresh_from_db()
+        self.assertEqual(r1.title, 'First')
+        self.assertEqual(r2.title, 'Sample recipe')
+        self.assertEqual([tag.name for tag in r2.tags.all()], ['New'])
+
+    def test_bulk_update_keeps_unchanged_links(self):
+        """ Test only the links that changed are deleted and inserted """
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(
+            Tag.objects.create(user=self.user, name='Old'),
+            Tag.objects.create(user=self.user, name='Kept'),
+        )
+        through = Recipe.tags.through
+        kept = through.objects.get(recipe=recipe, tag__name='Kept')
+
+        payload = [
+            {'id': recipe.id, 'tags': [{'name': 'Kept'}, {'name': 'New'}]},
+        ]
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(tag.name for tag in recipe.tags.all()), ['Kept', 'New'],
+        )
+        self.assertTrue(through.objects.filter(id=kept.id).exists())
+
+    def test_bulk_update_query_count_is_constant(self):
+        """ Test replacing the tags of more recipes takes no more queries """
+        recipes = [create_recipe(user=self.user) for _ in range(12)]
+        old = Tag.objects.create(user=self.user, name='Old')
+        for recipe in recipes:
+            recipe.tags.add(old)
+
+        def relabel(batch, name):
+            payload = [
+                {'id': recipe.id, 'tags': [{'name': name}]} for recipe in batch
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.patch(BULK_URL, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            return queries
+
+        few = relabel(recipes[:2], 'Few')
+        many = relabel(recipes[2:], 'Many')
+
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(
+            [tag.name for tag in recipes[-1].tags.all()], ['Many'],
+        )
+
+    def test_bulk_update_other_users_recipe_error(self):
+        """ Test recipes of other users cannot be bulk updated """
+        other_user = create_user(email='other@example.com')
+        recipe = create_recipe(user=other_user)
+
+        payload = [{'id': recipe.id, 'title': 'Mine'}]
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('id', res.data[0])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'Sample recipe')
+
+    def test_bulk_delete_recipes(self):
+        """ Test deleting many recipes by id """
+        recipes = [create_recipe(user=self.user) for _ in range(3)]
+
+        ids = [recipe.id for recipe in recipes[:2]]
+        res = self.client.delete(BULK_URL, ids, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        remaining = Recipe.objects.filter(user=self.user)
+        self.assertEqual(list(remaining), [recipes[2]])
+
+    @override_settings(BULK_MAX_RECIPES=2)
+    def test_bulk_too_many_items_error(self):
+        """ Test requests above the bulk limit are rejected """
+        res = self.client.post(BULK_URL, self._payload(3), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+
+class ExportRecipeApiTests(TestCase):
+    """ Test the streaming recipe export """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def _export(self):
+        """ Request the export and return the decoded lines """
+        res = self.client.get(EXPORT_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        body = b''.join(res.streaming_content).decode()
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_export_recipes(self):
+        """ Test exporting streams every recipe of the user, one per line """
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        r1 = create_recipe(user=self.user, title='Curry')
+        r1.tags.add(tag)
+        r2 = create_recipe(user=self.user, title='Salad')
+        create_recipe(user=create_user(email='other@example.com'))
+
+        lines = self._export()
+
+        self.assertEqual([line['id'] for line in lines], [r2.id, r1.id])
+        self.assertEqual(lines[1]['tags'], [{'id': tag.id, 'name': 'Vegan'}])
+        self.assertEqual(lines[1]['description'], r1.description)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_prefetches_per_chunk(self):
+        """ Test relations are prefetched once per chunk, not per recipe """
+        for i in range(5):
+            create_recipe(user=self.user).tags.add(
+                Tag.objects.create(user=self.user, name=f'Tag {i}')
+            )
+
+        # The cursor plus tags and ingredients for each of the 3 chunks.
+        with self.assertNumQueries(1 + 3 * 2):
+            lines = self._export()
+
+        self.assertEqual(len(lines), 5)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_without_server_side_cursors(self):
+        """ Test behind a transaction pooler the export pages by id """
+        recipes = [create_recipe(user=self.user) for _ in range(5)]
+
+        no_cursors = patch.dict(
+            connection.settings_dict, DISABLE_SERVER_SIDE_CURSORS=True,
+        )
+        with no_cursors, CaptureQueriesContext(connection) as queries:
+            lines = self._export()
+
+        self.assertEqual(
+            [line['id'] for line in lines], [r.id for r in reversed(recipes)],
+        )
+        pages = [q['sql'] for q in queries if 'FROM "core_recipe"' in q['sql']]
+        # 3 pages and the empty one ending the export.
+        self.assertEqual(len(pages), 4)
+        self.assertTrue(all('OFFSET' not in sql for sql in pages))
+
+    async def test_export_over_asgi(self):
+        """ Test the export reads no rows from the event loop under ASGI """
+        recipe = await sync_to_async(create_recipe)(user=self.user)
+        token = await sync_to_async(issue_signed_token)(self.user)
+
+        res = await AsyncClient().get(
+            EXPORT_URL, authorization=f'Token {token}',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res['Content-Disposition'],
+            'attachment; filename="recipes.ndjson"',
+        )
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)['id'] for line in lines], [recipe.id],
+        )
 
  # Implement image API
+@override_settings(RECIPE_IMAGE_PROCESSING_EAGER=True)
 class ImageUploadTests(TestCase):
     """ Tests for the image uplaod APIs """
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user = create_user(
             email = 'user@example.com',
@@ -441,22 +1006,329 @@ class ImageUploadTests(TestCase):
         self.recipe = create_recipe(user=self.user)
 
     def tearDown(self):
-        self.recipe.image.delete()
+        if Recipe.objects.filter(id=self.recipe.id).exists():
+            self.recipe.refresh_from_db()
+        delete_image_files(self.recipe.image.name)
 
-    def test_upload_image(self):
-        """ Test uploading an image to recipe """
+    def _jpeg_bytes(self, img):
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG')
+        return buffer.getvalue()
+
+    def _upload(self, img, **save_kwargs):
+        """ Upload img and run the background processing inline """
         url = image_upload_url(self.recipe.id)
         # Create a temporary image file
         with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
-            img = Image.new('RGB', (10, 10))
-            img.save(image_file, format='JPEG')
+            img.save(image_file, format='JPEG', **save_kwargs)
             image_file.seek(0)
-            res = self.client.post(url, {'image': image_file}, format='multipart')
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(
+                    url, {'image': image_file}, format='multipart',
+                )
+
+        self.recipe.refresh_from_db()
+        return res
+
+    def test_upload_image(self):
+        """ Test uploading an image to recipe """
+        res = self._upload(Image.new('RGB', (10, 10)))
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['status'], RecipeImageJob.PENDING)
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+        job = RecipeImageJob.objects.get(id=res.data['id'])
+        self.assertEqual(job.status, RecipeImageJob.DONE)
+        self.assertFalse(job.source)
+
+    def test_upload_image_creates_variants(self):
+        """ Test resized WebP and JPEG variants are stored """
+        self._upload(Image.new('RGB', (3000, 1500)))
+
+        with Image.open(self.recipe.image.path) as img:
+            self.assertEqual(img.size, (2048, 1024))
+        for size in (1024, 512, 128):
+            for fmt in ('webp', 'jpeg'):
+                name = variant_name(self.recipe.image.name, size, fmt)
+                self.assertTrue(default_storage.exists(name))
+                with default_storage.open(name) as f, Image.open(f) as img:
+                    self.assertEqual(img.size, (size, size // 2))
+
+    def test_upload_image_strips_exif(self):
+        """ Test the EXIF orientation is applied and the metadata removed """
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotated 90 degrees.
+        exif[0x010F] = 'Camera maker'
+        self._upload(Image.new('RGB', (30, 10)), exif=exif.tobytes())
+
+        with Image.open(self.recipe.image.path) as img:
+            self.assertEqual(img.size, (10, 30))
+            self.assertEqual(dict(img.getexif()), {})
+
+    def test_get_image_status(self):
+        """ Test retrieving the state of the latest upload """
+        self._upload(Image.new('RGB', (10, 10)))
+
+        res = self.client.get(image_upload_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['status'], RecipeImageJob.DONE)
+        self.assertTrue(
+            res.data['recipe_image'].endswith(self.recipe.image.name)
+        )
+
+    def test_thumbnails_redirect_to_stored_variants(self):
+        """ Test the thumbnails redirect to the variants made on upload """
+        self._upload(Image.new('RGB', (20, 10)))
+
+        spy = patch.object(
+            default_storage, 'exists', wraps=default_storage.exists,
+        )
+        with spy as exists:
+            res = self.client.get(detail_url(self.recipe.id))
+
+        exists.assert_not_called()
+        self.assertEqual(set(res.data['thumbnails']), {'1024', '512', '128'})
+        url = res.data['thumbnails']['128']['webp']
+        self.assertTrue(
+            url.endswith(thumbnail_url(self.recipe.id, 128, 'webp'))
+        )
+        res = self.client.get(url)
+        name = variant_name(self.recipe.image.name, 128, 'webp')
+        self.assertEqual(res['Location'], default_storage.url(name))
+
+    def test_thumbnail_generated_on_first_request(self):
+        """ Test a missing thumbnail is generated lazily and redirected to """
+        self._upload(Image.new('RGB', (600, 300)))
+        name = variant_name(self.recipe.image.name, 512, 'jpeg')
+        default_storage.delete(name)
 
+        res = self.client.get(thumbnail_url(self.recipe.id, 512, 'jpeg'))
+
+        self.assertEqual(res.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(res['Location'], default_storage.url(name))
+        with default_storage.open(name) as f, Image.open(f) as img:
+            self.assertEqual(img.size, (512, 256))
+
+    def test_thumbnail_unknown_size_not_found(self):
+        """ Test requesting a size that is not configured returns 404 """
+        self._upload(Image.new('RGB', (10, 10)))
+
+        res = self.client.get(thumbnail_url(self.recipe.id, 300, 'jpeg'))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_thumbnails_without_image(self):
+        """ Test a recipe without an image has no thumbnails """
+        res = self.client.get(detail_url(self.recipe.id))
+
+        self.assertIsNone(res.data['thumbnails'])
+        res = self.client.get(thumbnail_url(self.recipe.id, 128, 'webp'))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_image_status_without_upload(self):
+        """ Test the state of a recipe without uploads is not found """
+        res = self.client.get(image_upload_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_processing_failure_marks_job_failed(self):
+        """ Test a job whose image cannot be decoded is marked failed """
+        job = RecipeImageJob.objects.create(
+            recipe=self.recipe,
+            source=SimpleUploadedFile('broken.jpg', b'not an image'),
+        )
+
+        process_image_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, RecipeImageJob.FAILED)
+        self.assertTrue(job.error)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    def test_claim_refreshes_updated_at(self):
+        """ Test claiming a job restarts its stale timer """
+        job = RecipeImageJob.objects.create(
+            recipe=self.recipe,
+            source=SimpleUploadedFile('broken.jpg', b'not an image'),
+        )
+        created = timezone.now() - timedelta(hours=1)
+        RecipeImageJob.objects.filter(id=job.id).update(updated_at=created)
+        claimed_at = []
+
+        def record_claim(source):
+            claimed_at.append(RecipeImageJob.objects.get(id=job.id).updated_at)
+            raise ValueError('stop')
+
+        with patch('recipe.images.file_digest', side_effect=record_claim):
+            process_image_job(job.id)
+
+        self.assertGreater(claimed_at[0], created + timedelta(minutes=59))
+
+    def test_image_stored_outside_blob_lock(self):
+        """ Test the image is encoded before the blob row is locked """
+        job = RecipeImageJob.objects.create(
+            recipe=self.recipe,
+            source=SimpleUploadedFile(
+                'a.jpg', self._jpeg_bytes(Image.new('RGB', (10, 10))),
+            ),
+        )
+        store_image = images._store_image
+        savepoints = []
+
+        def record_savepoints(*args):
+            savepoints.append(len(connection.savepoint_ids))
+            return store_image(*args)
+
+        store = patch(
+            'recipe.images._store_image', side_effect=record_savepoints,
+        )
+        with store:
+            process_image_job(job.id)
+
+        self.assertEqual(savepoints, [len(connection.savepoint_ids)])
+        self.recipe.refresh_from_db()
+        self.assertTrue(default_storage.exists(self.recipe.image.name))
+
+    def _job(self, recipe, color):
+        """ Create a pending job uploading a plain image of color """
+        return RecipeImageJob.objects.create(
+            recipe=recipe,
+            source=SimpleUploadedFile(
+                'a.jpg', self._jpeg_bytes(Image.new('RGB', (10, 10), color)),
+            ),
+        )
+
+    def test_concurrent_jobs_release_each_image_once(self):
+        """ Test a job finishing first is seen by the other recipe job """
+        other = create_recipe(user=self.user)
+        process_image_job(self._job(self.recipe, 'red').id)
+        process_image_job(self._job(other, 'red').id)
+        shared = RecipeImageBlob.objects.get()
+        first = self._job(self.recipe, 'green')
+        second = self._job(self.recipe, 'blue')
+        store_image = images._store_image
+        calls = []
+
+        def store_other_job_first(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                # The first job finishes while the second one encodes.
+                process_image_job(first.id)
+            return store_image(*args)
+
+        store = patch(
+            'recipe.images._store_image', side_effect=store_other_job_first,
+        )
+        with store:
+            process_image_job(second.id)
+
+        refs = dict(RecipeImageBlob.objects.values_list('name', 'ref_count'))
         self.recipe.refresh_from_db()
+        self.assertEqual(refs.pop(shared.name), 1)
+        self.assertEqual(refs.pop(self.recipe.image.name), 1)
+        self.assertEqual(list(refs.values()), [0])
+
+    def test_recipe_deleted_while_job_runs(self):
+        """ Test a job whose recipe is deleted meanwhile is not saved again """
+        job = self._job(self.recipe, 'red')
+        file_digest = images.file_digest
+
+        def delete_recipe_first(source):
+            Recipe.objects.filter(id=self.recipe.id).delete()
+            return file_digest(source)
+
+        digest = patch(
+            'recipe.images.file_digest', side_effect=delete_recipe_first,
+        )
+        with digest:
+            process_image_job(job.id)
+
+        self.assertFalse(RecipeImageJob.objects.filter(id=job.id).exists())
+        self.assertFalse(default_storage.exists(job.source.name))
+
+    def test_image_not_writable_through_detail(self):
+        """ Test PATCH on a recipe ignores an image """
+        img = Image.new('RGB', (10, 10))
+        res = self.client.patch(
+            detail_url(self.recipe.id),
+            {'image': SimpleUploadedFile('a.jpg', self._jpeg_bytes(img))},
+            format='multipart',
+        )
+
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    def test_same_image_stored_once(self):
+        """ Test recipes given the same image share its stored files """
+        other = create_recipe(user=self.user)
+        img = Image.new('RGB', (10, 10))
+        self._upload(img)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                image_upload_url(other.id),
+                {'image': SimpleUploadedFile('a.jpg', self._jpeg_bytes(img))},
+                format='multipart',
+            )
+
+        other.refresh_from_db()
+        self.assertEqual(other.image.name, self.recipe.image.name)
+        blob = RecipeImageBlob.objects.get()
+        self.assertEqual(blob.name, self.recipe.image.name)
+        self.assertEqual(blob.ref_count, 2)
+        job = RecipeImageJob.objects.first()
+        self.assertEqual(
+            job.digest, hashlib.sha256(self._jpeg_bytes(img)).hexdigest(),
+        )
+
+    def test_replace_and_delete_release_image(self):
+        """ Test replacing or deleting drops the reference to the image """
+        self._upload(Image.new('RGB', (10, 10)))
+        first = RecipeImageBlob.objects.get(name=self.recipe.image.name)
+        self._upload(Image.new('RGB', (20, 20)))
+        first.refresh_from_db()
+        self.assertEqual(first.ref_count, 0)
+        # Files are left for gc_recipe_images.
+        self.assertTrue(default_storage.exists(first.name))
+        self.addCleanup(delete_image_files, first.name)
+
+        self.client.delete(detail_url(self.recipe.id))
+
+        second = RecipeImageBlob.objects.get(name=self.recipe.image.name)
+        self.assertEqual(second.ref_count, 0)
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=100 * 100)
+    def test_upload_image_too_many_pixels(self):
+        """ Test an image over the pixel limit is refused from its header """
+        res = self._upload(Image.new('RGB', (101, 100)))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('image', res.data)
-        self.assertTrue(os.path.exists(self.recipe.image.path))
+        self.assertFalse(RecipeImageJob.objects.exists())
+
+    @override_settings(RECIPE_IMAGE_MAX_UPLOAD_SIZE=1024)
+    def test_upload_image_too_large(self):
+        """ Test an upload over the size limit is refused before it is read """
+        noise = Image.frombytes('RGB', (200, 200), os.urandom(200 * 200 * 3))
+        res = self._upload(noise, quality=100)
+
+        self.assertEqual(
+            res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+        self.assertFalse(RecipeImageJob.objects.exists())
+
+    @override_settings(RECIPE_IMAGE_MAX_UPLOAD_SIZE=1024)
+    def test_upload_handler_stops_streaming_at_limit(self):
+        """ Test the handler refuses the chunk crossing the size limit """
+        handler = BoundedImageUploadHandler()
+        handler.new_file('image', 'image.jpg', 'image/jpeg', None)
+
+        handler.receive_data_chunk(b'x' * 1000, 0)
+        with self.assertRaises(UploadTooLarge):
+            handler.receive_data_chunk(b'x' * 1000, 1000)
+        self.assertTrue(handler.file.closed)
 
     def test_upload_image_bad_request(self):
         """ Test uploading an invalid image """
@@ -464,3 +1336,4 @@ class ImageUploadTests(TestCase):
         res = self.client.post(url, {'image': 'notimage'}, format='multipart')
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(RecipeImageJob.objects.exists())
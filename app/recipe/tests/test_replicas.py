@@ -0,0 +1,166 @@
+"""
+Tests for read replica routing of the recipe API
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections
+from django.test import (
+    SimpleTestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+from core.routers import (
+    PrimaryReplicaRouter,
+    check_pin_cache,
+    end_replica_reads,
+    start_replica_reads,
+)
+from user.authentication import clear_local_cache, issue_signed_token
+
+RECIPE_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], RECIPE_LIST_CACHE_TIMEOUT=0)
+class ReplicaRoutingTests(TransactionTestCase):
+    """ Test reads go to the replica alias and writes to default
+
+    The replica alias connects to the test database over its own
+    connection, like a replica that has caught up, so the tests can tell
+    which alias served each query.
+    """
+
+    # Resolved in setUpClass, after the replica alias is registered.
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        settings_dict = connections['default'].settings_dict
+        # Marked as a mirror so TransactionTestCase does not flush it twice.
+        connections.databases['replica'] = {
+            **settings_dict,
+            'TEST': {**settings_dict['TEST'], 'MIRROR': 'default'},
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='testpass123',
+        )
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {issue_signed_token(self.user)}',
+        )
+
+    def _queries(self, method, url, data=None):
+        """ Make a request, return (response, default, replica queries) """
+        with CaptureQueriesContext(connections['default']) as default, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            res = getattr(self.client, method)(url, data, format='json')
+
+        return res, default.captured_queries, replica.captured_queries
+
+    def test_reads_use_replica(self):
+        """ Test safe requests read from the replica """
+        Recipe.objects.create(
+            user=self.user, title='Curry', time_minutes=5,
+            price=Decimal('1.00'),
+        )
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        res, default, replica = self._queries('get', RECIPE_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertTrue(replica)
+
+        res, default, replica = self._queries('get', TAGS_URL)
+        self.assertEqual(res.data['results'][0]['name'], 'Vegan')
+        self.assertTrue(replica)
+
+    def test_authentication_reads_primary(self):
+        """ Test the user of a token is looked up on the primary """
+        res, default, replica = self._queries('get', RECIPE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(any('"core_user"' in q['sql'] for q in default))
+        self.assertFalse(any('"core_user"' in q['sql'] for q in replica))
+
+    def test_read_your_writes(self):
+        """ Test a user reads from the primary right after writing """
+        payload = {'title': 'Curry', 'time_minutes': 5, 'price': '1.00'}
+        res, default, replica = self._queries('post', RECIPE_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(replica)
+
+        res, default, replica = self._queries('get', RECIPE_URL)
+
+        self.assertEqual(res.data['results'][0]['title'], 'Curry')
+        self.assertFalse(replica)
+
+    @override_settings(READ_REPLICA_PIN_SECONDS=0)
+    def test_pin_expires(self):
+        """ Test reads go back to the replica once the pin expired """
+        payload = {'name': 'Vegan'}
+        self._queries('post', TAGS_URL, payload)
+
+        res, default, replica = self._queries('get', TAGS_URL)
+
+        self.assertEqual(res.data['results'][0]['name'], 'Vegan')
+        self.assertTrue(replica)
+
+    def test_router(self):
+        """ Test the router outside and inside replica reads """
+        router = PrimaryReplicaRouter()
+        self.assertIsNone(router.db_for_read(Recipe))
+
+        token = start_replica_reads()
+        try:
+            self.assertEqual(router.db_for_read(Recipe), 'replica')
+            self.assertEqual(router.db_for_write(Recipe), 'default')
+        finally:
+            end_replica_reads(token)
+
+        self.assertIsNone(router.db_for_read(Recipe))
+        self.assertFalse(router.allow_migrate('replica', 'core'))
+        self.assertIsNone(router.allow_migrate('default', 'core'))
+
+
+class PinCacheCheckTests(SimpleTestCase):
+    """ Test the check of the cache keeping the replica pins """
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_per_process_cache_warns(self):
+        """ Test pins in a per-process cache are reported """
+        errors = check_pin_cache(None)
+
+        self.assertEqual([error.id for error in errors], ['core.W001'])
+
+    @override_settings(
+        DATABASE_REPLICAS=['replica'],
+        CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        }},
+    )
+    def test_shared_cache_passes(self):
+        """ Test another cache backend is not reported """
+        self.assertEqual(check_pin_cache(None), [])
+
+    def test_without_replicas_passes(self):
+        """ Test nothing is reported when there is no replica """
+        self.assertEqual(check_pin_cache(None), [])
@@ -4,14 +4,16 @@ Tests for the tags API.
 from decimal import Decimal
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Tag, Recipe
+from core.models import Tag, Recipe, has_trigram_support
 
+from recipe.autocomplete import clear_tries
 from recipe.serializers import TagSerializer
 
 TAGS_URL = reverse('recipe:tag-list')
@@ -41,6 +43,7 @@ class PrivateTagsApiTests(TestCase):
     """ Test the authorized user tags API """
 
     def setUp(self):
+        cache.clear()
         self.user = create_user()
         self.client = APIClient()
         self.client.force_authenticate(self.user)
@@ -56,7 +59,21 @@ class PrivateTagsApiTests(TestCase):
         serializer = TagSerializer(tags, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
+
+    def test_tags_paginated(self):
+        """ Test paging through tags returns each tag once, by name """
+        names = ['Vegan', 'Dessert', 'Breakfast', 'Lunch']
+        for name in names:
+            Tag.objects.create(user=self.user, name=name)
+
+        res = self.client.get(TAGS_URL, {'page_size': 1})
+        result_names = [item['name'] for item in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            result_names.extend(item['name'] for item in res.data['results'])
+
+        self.assertEqual(result_names, sorted(names, reverse=True))
 
     def test_tags_limited_to_user(self):
         """ Test that tags returned are for the authenticated user """
@@ -67,9 +84,9 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['name'], tag.name)
-        self.assertEqual(res.data[0]['id'], tag.id)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['name'], tag.name)
+        self.assertEqual(res.data['results'][0]['id'], tag.id)
 
     def test_update_tag(self):
         """ Test updating a tag """
@@ -83,6 +100,15 @@ class PrivateTagsApiTests(TestCase):
         tag.refresh_from_db()
         self.assertEqual(tag.name, payload['name'])
 
+    def test_create_duplicate_tag_error(self):
+        """ Test creating a tag with an existing name returns an error """
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        res = self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
     def test_delete_tag(self):
         """ Test deleting a tag """
         tag = Tag.objects.create(user=self.user, name='Vegan')
@@ -114,8 +140,8 @@ class PrivateTagsApiTests(TestCase):
         serializer1 = TagSerializer(tag1)
         serializer2 = TagSerializer(tag2)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
 
     def test_filter_tags_assigned_unique(self):
         """ Test filtering tags by assigned returns unique items """
@@ -143,5 +169,55 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
         # Check that only 1 tag is returned
-        self.assertEqual(len(res.data), 1)
+        self.assertEqual(len(res.data['results']), 1)
+
+
+@override_settings(AUTOCOMPLETE_LIMIT=3, AUTOCOMPLETE_TRIE_MIN_REQUESTS=2)
+class AutocompleteTagsApiTests(TestCase):
+    """ Test the ?q= autocomplete of tags """
+
+    def setUp(self):
+        cache.clear()
+        clear_tries()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for name in ('Vegetarian', 'vegan', 'Veg', 'Savory', 'Dessert'):
+            Tag.objects.create(user=self.user, name=name)
+        other_user = create_user('other@example.com')
+        Tag.objects.create(user=other_user, name='Veggie')
+
+    def _names(self, q):
+        res = self.client.get(TAGS_URL, {'q': q})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [tag['name'] for tag in res.data]
+
+    def test_prefix_matches_first_and_limited(self):
+        """ Test names starting with q come first, by name, up to the limit """
+        self.assertEqual(self._names('veg'), ['Veg', 'vegan', 'Vegetarian'])
+
+    def test_similar_names_fill_up_results(self):
+        """ Test names containing q follow the prefix matches """
+        self.assertEqual(self._names('ssert'), ['Dessert'])
+
+    def test_similar_names_tolerate_typos(self):
+        """ Test names close to q are matched by trigram similarity """
+        if not has_trigram_support('default'):
+            self.skipTest('Needs pg_trgm')
+        self.assertEqual(self._names('desert'), ['Dessert'])
+
+    def test_trie_serves_hot_users(self):
+        """ Test repeated lookups are served without querying the database """
+        self.assertEqual(self._names('ve'), ['Veg', 'vegan', 'Vegetarian'])
+        self.assertEqual(self._names('ve'), ['Veg', 'vegan', 'Vegetarian'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self._names('v'), ['Veg', 'vegan', 'Vegetarian'])
+
+    def test_trie_follows_changes(self):
+        """ Test a tag created through the API shows up in the trie """
+        for _ in range(2):
+            self._names('ve')
+        self.client.post(TAGS_URL, {'name': 'Vegetables'})
 
+        self.assertEqual(self._names('vegeta'), ['Vegetables', 'Vegetarian'])
@@ -0,0 +1,103 @@
+"""
+Upload handling for recipe images
+"""
+import hashlib
+import io
+
+from PIL import Image
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+
+# Multipart boundaries and part headers sent alongside the image.
+MULTIPART_OVERHEAD = 64 * 1024
+# Most formats state their dimensions in the first few KB, JPEG only after
+# any EXIF block, which is itself capped at 64KB.
+MAX_HEADER_SIZE = 256 * 1024
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Uploaded file is too large.'
+    default_code = 'upload_too_large'
+
+
+def image_dimensions(header):
+    """ Return the (width, height) stated in an image header, or None """
+    try:
+        with Image.open(io.BytesIO(header)) as image:
+            return image.size
+    except Image.DecompressionBombError:
+        raise
+    except Exception:
+        # Not an image, or not enough of the header yet.
+        return None
+
+
+class BoundedImageUploadHandler(TemporaryFileUploadHandler):
+    """ Stream an image upload to a temporary file, rejecting it early
+
+    The upload is written to disk chunk by chunk, so memory use is bounded
+    by the chunk size plus the buffered header. Uploads over
+    RECIPE_IMAGE_MAX_UPLOAD_SIZE bytes or whose header states more than
+    RECIPE_IMAGE_MAX_PIXELS pixels are refused before the rest is read.
+    The SHA-256 digest of the upload is computed on the way and set on the
+    uploaded file as digest.
+    """
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None,
+    ):
+        limit = settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD
+        if content_length > limit:
+            raise UploadTooLarge()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.size = 0
+        self.header = b''
+        self.hasher = hashlib.sha256()
+
+    def _reject(self, error):
+        self.file.close()
+        raise error
+
+    def _check_header(self):
+        try:
+            size = image_dimensions(self.header)
+        except Image.DecompressionBombError as error:
+            self._reject(ValidationError({'image': [str(error)]}))
+        if size is None:
+            if len(self.header) >= MAX_HEADER_SIZE:
+                # Left to the serializer to report as an invalid image.
+                self.header = None
+            return
+
+        self.header = None
+        width, height = size
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            self._reject(ValidationError({'image': [
+                f'Image is {width}x{height}, at most '
+                f'{settings.RECIPE_IMAGE_MAX_PIXELS} pixels are allowed.'
+            ]}))
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE:
+            self._reject(UploadTooLarge())
+
+        if self.header is not None:
+            self.header += raw_data[:MAX_HEADER_SIZE - len(self.header)]
+            self._check_header()
+
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.digest = self.hasher.hexdigest()
+        return file
@@ -1,11 +1,13 @@
 """
 URL mappping for the recipe app
 """
+from django.conf import settings
 from django.urls import path, include
 
 from rest_framework.routers import DefaultRouter
 
 from recipe import views
+from recipe.async_views import async_read_views
 
 
 router = DefaultRouter()
@@ -15,7 +17,11 @@ router.register('ingredients', views.IngredientViewSet)
 
 app_name = 'recipe'
 
+router_urls = router.urls
+if settings.ASYNC_READ_VIEWS:
+    router_urls = async_read_views(router_urls)
+
 urlpatterns = [
-    path('', include(router.urls)),
+    path('', include(router_urls)),
 ]
 
@@ -1,21 +1,55 @@
 """
 Views for the recipe app
 """
+import tempfile
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, Exists, OuterRef, prefetch_related_objects
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    FileResponse, HttpResponseRedirect, StreamingHttpResponse,
+)
+
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter, OpenApiTypes
 
 from rest_framework import viewsets,  mixins, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 
 from core.models import Recipe, Tag, Ingredient
 from recipe import serializers
+from recipe.autocomplete import get_user_trie
+from recipe.cache import (
+    CachedListMixin,
+    ConditionalGetMixin,
+    invalidate_user_cache,
+)
+from recipe.images import VARIANT_FORMATS, enqueue_image_job, get_variant
+from recipe.renderers import NDJSONRenderer
+from recipe.replicas import ReplicaReadMixin
+from recipe.uploads import BoundedImageUploadHandler
+from recipe.pagination import (
+    RecipeCursorPagination, RecipeAttrCursorPagination,
+)
+from user.authentication import SignedTokenAuthentication
 
 
 @extend_schema_view(
     list=extend_schema(
         parameters=[
+            OpenApiParameter(
+                'search',
+                OpenApiTypes.STR,
+                description=(
+                    'Search titles, descriptions, tags and ingredients'
+                ),
+            ),
             OpenApiParameter(
                 'tags',
                 OpenApiTypes.STR,
@@ -26,35 +60,127 @@ from recipe import serializers
                 OpenApiTypes.STR,
                 description='Comma separated list of ingredients Ids to filter',
             ),
+            OpenApiParameter(
+                'match',
+                OpenApiTypes.STR, enum=['any', 'all'],
+                description=(
+                    'Return recipes having any (default) or all of the '
+                    'given tags and ingredients'
+                ),
+            ),
+            OpenApiParameter(
+                'min_time', OpenApiTypes.INT,
+                description='Minimum preparation time in minutes',
+            ),
+            OpenApiParameter(
+                'max_time', OpenApiTypes.INT,
+                description='Maximum preparation time in minutes',
+            ),
+            OpenApiParameter(
+                'min_price', OpenApiTypes.DECIMAL, description='Minimum price',
+            ),
+            OpenApiParameter(
+                'max_price', OpenApiTypes.DECIMAL, description='Maximum price',
+            ),
+            OpenApiParameter(
+                'ordering',
+                OpenApiTypes.STR,
+                enum=list(serializers.RecipeFilterSerializer.ORDERING_CHOICES),
+                description=(
+                    'Sort order, newest first (-id) by default or by rank '
+                    'when searching'
+                ),
+            ),
         ]
     ),
 )
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    ReplicaReadMixin, ConditionalGetMixin, CachedListMixin,
+    viewsets.ModelViewSet,
+):
     """ View for manage recipe APIs """
     serializer_class = serializers.RecipeDetailSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecipeCursorPagination
+
+    # Range params and the lookups they compile to, served by the
+    # (user, time_minutes, id) and (user, price, id) indexes.
+    RANGE_FILTERS = {
+        'min_time': 'time_minutes__gte',
+        'max_time': 'time_minutes__lte',
+        'min_price': 'price__gte',
+        'max_price': 'price__lte',
+    }
 
-    def _params_to_ints(self, qs):
+    def _params_to_ints(self, qs, name):
         """ Convert a list of string IDs to a list of integers """
         # 1, 2, 3 -> [1, 2, 3]
-        return [int(str_id) for str_id in qs.split(',')]
+        try:
+            return [int(str_id) for str_id in qs.split(',')]
+        except ValueError:
+            raise ValidationError(
+                {name: ['Must be a comma separated list of IDs.']}
+            )
 
     # Implement filter API for recipe
     def get_queryset(self):
         """ Retrieve the recipes for the authenticated user """
         tags = self.request.query_params.get('tags')
         ingredients = self.request.query_params.get('ingredients')
+        match = self.request.query_params.get('match', 'any')
+        if match not in ('any', 'all'):
+            raise ValidationError({'match': ['Must be "any" or "all".']})
+        match_all = match == 'all'
         queryset = self.queryset
         if tags:
-            tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            tag_ids = self._params_to_ints(tags, 'tags')
+            queryset = queryset.filter_related('tags', tag_ids, match_all)
         if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            ingredient_ids = self._params_to_ints(ingredients, 'ingredients')
+            queryset = queryset.filter_related(
+                'ingredients', ingredient_ids, match_all
+            )
+
+        params = serializers.RecipeFilterSerializer(
+            data=self.request.query_params,
+        )
+        params.is_valid(raise_exception=True)
+        queryset = queryset.filter(**{
+            lookup: params.validated_data[name]
+            for name, lookup in self.RANGE_FILTERS.items()
+            if name in params.validated_data
+        })
 
-        return queryset.filter(user=self.request.user).order_by('-id').distinct()
+        # The search document is only read by the database.
+        queryset = queryset.filter(
+            user=self.request.user,
+        ).order_by('-id').defer('search_vector')
+        search = self.request.query_params.get('search', '').strip()
+        if search:
+            queryset = queryset.search(search)
+        ordering = params.validated_data.get('ordering')
+        if ordering:
+            # id breaks ties in the direction of the ordering, matching the
+            # index order so pages are read straight off the index.
+            tie_breaker = '-id' if ordering.startswith('-') else 'id'
+            queryset = queryset.order_by(
+                *dict.fromkeys([ordering, tie_breaker])
+            )
+
+        if self.action in ('list', 'retrieve'):
+            # Fetch nested tags and ingredients in one query each,
+            # instead of two extra queries per recipe.
+            queryset = queryset.prefetch_related('tags', 'ingredients')
+        if self.action == 'list':
+            # The list serializer does not return this column.
+            queryset = queryset.defer('description')
+
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_get(super().retrieve, request, *args, **kwargs)
 
     def get_serializer_class(self):
         """ Return appropriate serializer class """
@@ -68,20 +194,215 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """ Create a new recipe """
         serializer.save(user=self.request.user)
+        invalidate_user_cache(self.request.user)
+
+    def perform_update(self, serializer):
+        """ Update a recipe """
+        serializer.save()
+        invalidate_user_cache(self.request.user)
+
+    def perform_destroy(self, instance):
+        """ Delete a recipe """
+        instance.delete()
+        invalidate_user_cache(self.request.user)
 
     # Implement image API
-    @action(methods=['POST'], detail=True, url_path='upload-image')
+    @action(methods=['GET', 'POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
-        """ Upload an image to a recipe """
+        """ Queue an image upload for a recipe, or return its processing state
+
+        POST stores the raw upload and answers 202 straight away, the image
+        and its resized variants are produced by a background worker. GET
+        returns the state of the latest upload.
+        """
         recipe = self.get_object()
-        serializer = self.get_serializer(recipe, data=request.data)
+        if request.method == 'GET':
+            job = recipe.image_jobs.order_by('-id').first()
+            if job is None:
+                raise NotFound('No image has been uploaded for this recipe.')
+            return Response(self.get_serializer(job).data)
+
+        # Must be set before request.data parses the body.
+        request._request.upload_handlers = [
+            BoundedImageUploadHandler(request._request),
+        ]
+        serializer = self.get_serializer(data=request.data)
 
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            job = serializer.save(recipe=recipe)
+            enqueue_image_job(job)
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @extend_schema(responses={302: None})
+    @action(
+        methods=['GET'], detail=True,
+        url_path=r'thumbnails/(?P<size>\d+)\.(?P<fmt>[a-z]+)',
+    )
+    def thumbnail(self, request, pk=None, size=None, fmt=None):
+        """ Redirect to a thumbnail of the recipe image, made if needed """
+        recipe = self.get_object()
+        size = int(size)
+        if (
+            not recipe.image
+            or size not in settings.RECIPE_IMAGE_SIZES
+            or fmt not in VARIANT_FORMATS
+        ):
+            raise NotFound()
+
+        name = get_variant(recipe.image.name, size, fmt)
+        return HttpResponseRedirect(default_storage.url(name))
+
+    @extend_schema(
+        request=serializers.RecipeDetailSerializer(many=True),
+        responses=serializers.RecipeDetailSerializer(many=True),
+    )
+    @action(methods=['POST', 'PATCH', 'DELETE'], detail=False, url_path='bulk')
+    def bulk(self, request):
+        """ Create, update or delete many recipes in a single transaction
+
+        POST takes a list of recipes, PATCH a list of partial recipes with
+        their id and DELETE a list of ids. Errors are reported per item, in
+        the order of the request, and nothing is written if any item fails.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError(
+                {'non_field_errors': ['Expected a list of items.']}
+            )
+        if len(items) > settings.BULK_MAX_RECIPES:
+            raise ValidationError({'non_field_errors': [
+                'Ensure this list has at most '
+                f'{settings.BULK_MAX_RECIPES} items.'
+            ]})
+
+        with transaction.atomic():
+            if request.method == 'DELETE':
+                response = self._bulk_delete(items)
+            elif request.method == 'PATCH':
+                response = self._bulk_update(items)
+            else:
+                serializer = self.get_serializer(data=items, many=True)
+                serializer.is_valid(raise_exception=True)
+                serializer.save(user=request.user)
+                response = Response(
+                    serializer.data, status=status.HTTP_201_CREATED,
+                )
+        invalidate_user_cache(request.user)
+
+        return response
+
+    @extend_schema(responses={
+        (200, 'application/x-ndjson'): serializers.RecipeDetailSerializer,
+    })
+    @action(
+        methods=['GET'], detail=False,
+        renderer_classes=[NDJSONRenderer, JSONRenderer],
+    )
+    def export(self, request):
+        """ Stream every recipe of the user as newline delimited JSON
+
+        Rows are read through a server-side cursor and serialized one chunk
+        at a time, so memory use does not depend on the collection size.
+        """
+        lines = self._export_lines(self.get_queryset())
+        if isinstance(request._request, ASGIRequest):
+            # The ASGI handler iterates streaming responses on the event
+            # loop, where queries are not allowed, so the lines are written
+            # out here and only the file is streamed from there.
+            spool = tempfile.SpooledTemporaryFile(
+                max_size=settings.EXPORT_SPOOL_MAX_MEMORY,
+            )
+            spool.writelines(lines)
+            spool.seek(0)
+            return FileResponse(
+                spool, as_attachment=True, filename='recipes.ndjson',
+                content_type=NDJSONRenderer.media_type,
+            )
+
+        response = StreamingHttpResponse(
+            lines, content_type=NDJSONRenderer.media_type,
+        )
+        response['Content-Disposition'] = (
+            'attachment; filename="recipes.ndjson"'
+        )
+        return response
+
+    def _export_chunks(self, queryset, chunk_size):
+        """ Yield the recipes of queryset in lists of up to chunk_size """
+        settings_dict = connections[queryset.db].settings_dict
+        if not settings_dict['DISABLE_SERVER_SIDE_CURSORS']:
+            recipes = queryset.iterator(chunk_size=chunk_size)
+            while True:
+                chunk = list(islice(recipes, chunk_size))
+                if not chunk:
+                    return
+                yield chunk
+
+        # Without a server-side cursor iterator() fetches every row at
+        # once, so pages are read by id, or by offset for other orderings.
+        keyset = queryset.query.order_by == ('-id',)
+        start = 0
+        while True:
+            chunk = list(queryset[start:start + chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            if keyset:
+                queryset = queryset.filter(id__lt=chunk[-1].id)
+            else:
+                start += chunk_size
+
+    def _export_lines(self, queryset):
+        """ Yield one encoded JSON line per recipe """
+        renderer = JSONRenderer()
+        context = self.get_serializer_context()
+        for chunk in self._export_chunks(queryset, settings.EXPORT_CHUNK_SIZE):
+            prefetch_related_objects(chunk, 'tags', 'ingredients')
+            for item in serializers.RecipeDetailSerializer(
+                chunk, many=True, context=context,
+            ).data:
+                yield renderer.render(item) + b'\n'
+
+    def _get_bulk_instances(self, ids):
+        """ Return the user's recipes for ids, in order, and item errors """
+        recipes = self.get_queryset().in_bulk(
+            [pk for pk in ids if isinstance(pk, int)]
+        )
+        instances = [recipes.get(pk) for pk in ids]
+        errors = [
+            {} if recipe is not None else {'id': ['Not found.']}
+            for recipe in instances
+        ]
+        if any(errors):
+            raise ValidationError(errors)
+
+        return instances
+
+    def _bulk_update(self, items):
+        """ Partially update the recipes identified by each item's id """
+        instances = self._get_bulk_instances([
+            item.get('id') if isinstance(item, dict) else None
+            for item in items
+        ])
+        serializer = self.get_serializer(
+            instances, data=items, many=True, partial=True,
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def _bulk_delete(self, ids):
+        """ Delete the recipes with the given ids """
+        instances = self._get_bulk_instances(ids)
+        self.get_queryset().filter(
+            id__in=[recipe.id for recipe in instances]
+        ).delete()
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 @extend_schema_view(
     list=extend_schema(
@@ -91,44 +412,137 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 type=OpenApiTypes.INT, enum=[0, 1],
                 description='Filter only tags and ingredients which are assigned to recipes',
             ),
+            OpenApiParameter(
+                name='with_counts',
+                type=OpenApiTypes.INT, enum=[0, 1],
+                description=(
+                    'Include the number of recipes using each tag or '
+                    'ingredient as recipe_count'
+                ),
+            ),
+            OpenApiParameter(
+                name='q',
+                type=OpenApiTypes.STR,
+                description=(
+                    'Autocomplete: return the first names starting with q, '
+                    'then similar names, unpaginated'
+                ),
+            ),
         ]
     ),
 )
-class BaseRecipeAttrViewSet(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.UpdateModelMixin, mixins.DestroyModelMixin, mixins.CreateModelMixin):
+class BaseRecipeAttrViewSet(
+    ReplicaReadMixin,
+    ConditionalGetMixin,
+    CachedListMixin,
+    viewsets.GenericViewSet,
+    mixins.ListModelMixin,
+    mixins.UpdateModelMixin,
+    mixins.DestroyModelMixin,
+    mixins.CreateModelMixin,
+):
     """ Base viewset for user owned recipe attributes """
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [SignedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecipeAttrCursorPagination
+
+    def _flag(self, name):
+        """ Return whether the 0/1 query param name is set """
+        try:
+            return bool(int(self.request.query_params.get(name, 0)))
+        except ValueError:
+            raise ValidationError({name: ['Must be 0 or 1.']})
 
     def get_queryset(self):
         """ Return objects for the authenticated user """
         # Implement filter API for tags and ingredients
-        assigned_only = bool(
-            int(self.request.query_params.get('assigned_only', 0))
-        )
+        assigned_only = self._flag('assigned_only')
         # 1 -> True
         queryset = self.queryset
         if assigned_only:
-            # Filter only tags and ingredients which are assigned to recipes.
-            queryset = queryset.filter(recipe__isnull=False)
+            # Filter only tags and ingredients which are assigned to recipes,
+            # as a semi-join on the through table so no DISTINCT is needed.
+            rel = self.queryset.model.recipe_set.rel
+            links = rel.through.objects.filter(
+                **{rel.field.m2m_reverse_field_name(): OuterRef('pk')}
+            )
+            queryset = queryset.filter(Exists(links))
+        if self.action == 'list' and self._flag('with_counts'):
+            # Grouped count over the through table only, the recipe table
+            # is not joined.
+            queryset = queryset.annotate(recipe_count=Count('recipe'))
 
-        # Return only unique tags and ingredients which are assigned to the authenticated user.
         return queryset.filter(
             user=self.request.user
-        ).order_by('-name').distinct()
+        ).order_by('-name', '-id')
+
+    def get_serializer_class(self):
+        """ Return the serializer including recipe_count when requested """
+        if self.action == 'list' and self._flag('with_counts'):
+            return self.count_serializer_class
+
+        return self.serializer_class
+
+    def list(self, request, *args, **kwargs):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return super().list(request, *args, **kwargs)
+
+        serializer = self.get_serializer(self._autocomplete(text), many=True)
+        return Response(serializer.data)
+
+    def _autocomplete(self, text):
+        """ Return up to AUTOCOMPLETE_LIMIT names prefixed by or like text """
+        limit = settings.AUTOCOMPLETE_LIMIT
+        queryset = self.get_queryset()
+        trie = None
+        # The trie only holds the plain objects of all the user's names.
+        if not (self._flag('assigned_only') or self._flag('with_counts')):
+            trie = get_user_trie(self.basename, self.request.user, queryset)
+        if trie is not None:
+            results = trie.starting_with(text)
+        else:
+            results = list(queryset.starting_with(text)[:limit])
+        if len(results) < limit:
+            results += queryset.similar_to(text)[:limit - len(results)]
+
+        return results
+
+    def _save_unique(self, serializer, **kwargs):
+        """ Save the object, reporting a duplicate name as a 400 """
+        try:
+            with transaction.atomic():
+                serializer.save(**kwargs)
+        except IntegrityError:
+            raise ValidationError(
+                {'name': ['You already have an item with this name.']}
+            )
+        invalidate_user_cache(self.request.user)
 
     def perform_create(self, serializer):
         """ Create a new object """
-        serializer.save(user=self.request.user)
+        self._save_unique(serializer, user=self.request.user)
+
+    def perform_update(self, serializer):
+        """ Update an object """
+        self._save_unique(serializer)
+
+    def perform_destroy(self, instance):
+        """ Delete an object """
+        instance.delete()
+        invalidate_user_cache(self.request.user)
 
 
 class TagViewSet(BaseRecipeAttrViewSet):
     """ Manage tags in the database """
     serializer_class = serializers.TagSerializer
+    count_serializer_class = serializers.TagCountSerializer
     queryset = Tag.objects.all()
 
 
 class IngredientViewSet(BaseRecipeAttrViewSet):
     """ Manage ingredients in the database """
     serializer_class = serializers.IngredientSerializer
+    count_serializer_class = serializers.IngredientCountSerializer
     queryset = Ingredient.objects.all()
 
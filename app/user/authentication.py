@@ -0,0 +1,233 @@
+"""
+Authentication for the API
+"""
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+SIGNED_TOKEN_SALT = 'user.authentication.SignedTokenAuthentication'
+
+# Cache key -> (expiry, user), least recently used first.
+_local = OrderedDict()
+_lock = threading.Lock()
+
+
+def _cache():
+    return caches[settings.TOKEN_AUTH_CACHE_ALIAS]
+
+
+def _shared_timeout():
+    """ Return how long users are kept in the shared cache """
+    if isinstance(_cache(), LocMemCache):
+        # A per-process cache is not shared, invalidations never reach the
+        # other workers, so it keeps users no longer than the local tier.
+        return min(
+            settings.TOKEN_AUTH_CACHE_TIMEOUT,
+            settings.TOKEN_AUTH_LOCAL_TIMEOUT,
+        )
+    return settings.TOKEN_AUTH_CACHE_TIMEOUT
+
+
+def _token_cache_key(key):
+    # Token keys are credentials, they are never used as cache keys as is.
+    return f'auth:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def _user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _generation_key(cache_key):
+    return f'{cache_key}:generation'
+
+
+def _get_cached(cache_key):
+    """ Return (user, generation) of cache_key, user is None on a miss
+
+    Entries are stored with the generation of their key, which every
+    invalidation bumps, and only accepted while it is current.
+    """
+    with _lock:
+        entry = _local.get(cache_key)
+        if entry is not None:
+            if entry[0] >= time.monotonic():
+                _local.move_to_end(cache_key)
+                return entry[1], None
+            del _local[cache_key]
+
+    cache = _cache()
+    generation_key = _generation_key(cache_key)
+    values = cache.get_many([cache_key, generation_key])
+    generation = values.get(generation_key)
+    if generation is None:
+        # Seeded from the clock so an evicted generation never comes back
+        # at a value older entries were stored with.
+        cache.add(generation_key, time.time_ns(), None)
+        generation = cache.get(generation_key)
+    entry = values.get(cache_key)
+    if entry is not None and entry[0] == generation:
+        _set_local(cache_key, entry[1])
+        return entry[1], generation
+
+    return None, generation
+
+
+def _set_local(cache_key, user):
+    if not settings.TOKEN_AUTH_LOCAL_SIZE:
+        return
+    with _lock:
+        expires = time.monotonic() + settings.TOKEN_AUTH_LOCAL_TIMEOUT
+        _local[cache_key] = (expires, user)
+        _local.move_to_end(cache_key)
+        while len(_local) > settings.TOKEN_AUTH_LOCAL_SIZE:
+            _local.popitem(last=False)
+
+
+def _without_password(user):
+    """ Return a copy of user whose password hash is deferred """
+    # Loaded from the database if read, and left out of save().
+    user = copy.copy(user)
+    user.__dict__.pop('password', None)
+    return user
+
+
+def _set_cached(cache_key, user, generation):
+    """ Cache a user read from the database under generation """
+    cache = _cache()
+    if cache.get(_generation_key(cache_key)) != generation:
+        # Invalidated while the user was read, it may be outdated.
+        return
+    # Password hashes are never written to the cache.
+    user = _without_password(user)
+    cache.set(cache_key, (generation, user), _shared_timeout())
+    _set_local(cache_key, user)
+
+
+def _forget(cache_key):
+    with _lock:
+        _local.pop(cache_key, None)
+    cache = _cache()
+    generation_key = _generation_key(cache_key)
+    try:
+        cache.incr(generation_key)
+    except ValueError:
+        cache.set(generation_key, time.time_ns(), None)
+    cache.delete(cache_key)
+
+
+def invalidate_token(key):
+    """ Forget the cached user of a token """
+    _forget(_token_cache_key(key))
+
+
+def invalidate_user_tokens(user):
+    """ Forget the cached user of every token of user """
+    _forget(_user_cache_key(user.pk))
+    keys = Token.objects.filter(user_id=user.pk).values_list('key', flat=True)
+    for key in keys:
+        invalidate_token(key)
+
+
+def clear_local_cache():
+    """ Drop the tokens cached by this process """
+    with _lock:
+        _local.clear()
+
+
+def issue_signed_token(user):
+    """ Return a signed token for user, valid for SIGNED_TOKEN_MAX_AGE """
+    return signing.dumps(
+        {'u': user.pk, 'v': user.token_version}, salt=SIGNED_TOKEN_SALT,
+    )
+
+
+def revoke_signed_tokens(user):
+    """ Invalidate every signed token issued to user so far """
+    # Incremented in the database, user may be an outdated cached copy and
+    # concurrent revocations must not undo each other.
+    get_user_model().objects.filter(pk=user.pk).update(
+        token_version=F('token_version') + 1,
+    )
+    # update() sends no post_save, the cached user is dropped here.
+    invalidate_user_tokens(user)
+    user.refresh_from_db(fields=['token_version'])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ Token authentication caching the user of each token
+
+    Users are kept for TOKEN_AUTH_LOCAL_TIMEOUT seconds in a per-process LRU
+    and TOKEN_AUTH_CACHE_TIMEOUT seconds in the shared cache, so most
+    requests authenticate without a query. Logging out, deleting a token and
+    saving the user drop the cached entries, other processes may keep
+    theirs until the short local timeout expires. A per-process cache
+    backend is not shared, it keeps users for the local timeout only.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = _token_cache_key(key)
+        user, generation = _get_cached(cache_key)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            _set_cached(cache_key, user, generation)
+            return (user, token)
+
+        # Every request gets its own copy, views may change request.user.
+        user = copy.copy(user)
+        return (user, Token(key=key, user=user))
+
+
+class SignedTokenAuthentication(CachedTokenAuthentication):
+    """ Authenticate stateless signed tokens, or legacy authtoken keys
+
+    A signed token is an HMAC over the user id, the user's token_version and
+    the time it was issued, so checking it needs no lookup. The user itself
+    comes from the authentication cache, and must still be active with the
+    same token_version, which is how tokens are revoked. Keys of the
+    authtoken table, which contain no ':', are checked as before.
+    """
+
+    def authenticate_credentials(self, key):
+        if ':' not in key:
+            return super().authenticate_credentials(key)
+
+        try:
+            payload = signing.loads(
+                key,
+                salt=SIGNED_TOKEN_SALT,
+                max_age=settings.SIGNED_TOKEN_MAX_AGE,
+            )
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+        except signing.BadSignature:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        cache_key = _user_cache_key(payload['u'])
+        user, generation = _get_cached(cache_key)
+        if user is None:
+            user = get_user_model().objects.filter(pk=payload['u']).first()
+            if user is not None:
+                _set_cached(cache_key, user, generation)
+        if user is None or user.token_version != payload['v']:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+
+        return (copy.copy(user), key)
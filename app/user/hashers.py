@@ -0,0 +1,106 @@
+"""
+Password hashers bounded across every worker sharing a cache
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.cache import caches
+
+
+# Seconds a slot is held at most, so a worker killed while hashing does
+# not keep it.
+SLOT_LEASE = 30
+_RETRY_INTERVAL = 0.01
+
+_state = threading.local()
+
+
+class PasswordHashingBusy(Exception):
+    """ No hashing slot freed up within PASSWORD_HASH_TIMEOUT
+
+    Raised from check_password and set_password, the token view and
+    user.middleware.PasswordHashingBusyMiddleware answer it with a 429.
+    """
+
+
+def _cache():
+    return caches[settings.PASSWORD_HASH_CACHE_ALIAS]
+
+
+def slot_keys():
+    """ Return the cache keys of the PASSWORD_HASH_SLOTS hashing slots """
+    return [
+        f'password-hash:slot:{index}'
+        for index in range(settings.PASSWORD_HASH_SLOTS)
+    ]
+
+
+def _acquire_slot():
+    """ Return the key of a slot taken for this hash, None on timeout """
+    cache = _cache()
+    keys = slot_keys()
+    deadline = time.monotonic() + settings.PASSWORD_HASH_TIMEOUT
+    while True:
+        held = cache.get_many(keys)
+        for key in keys:
+            if key not in held and cache.add(key, True, SLOT_LEASE):
+                return key
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(_RETRY_INTERVAL)
+
+
+def run_bounded(func, *args):
+    """ Run a hashing function once a slot is free, shedding load if none is
+
+    At most PASSWORD_HASH_SLOTS hashes run at once across every process
+    sharing PASSWORD_HASH_CACHE_ALIAS. Callers wait up to
+    PASSWORD_HASH_TIMEOUT seconds for a slot, then PasswordHashingBusy is
+    raised instead of tying up the worker.
+    """
+    if getattr(_state, 'slot', None):
+        # PBKDF2 verify calls encode, which must not wait for a second slot.
+        return func(*args)
+
+    key = _acquire_slot()
+    if key is None:
+        raise PasswordHashingBusy()
+    _state.slot = key
+    try:
+        return func(*args)
+    finally:
+        _state.slot = None
+        _cache().delete(key)
+
+
+class BoundedHasherMixin:
+    """ Run encode and verify of a hasher through run_bounded """
+
+    def encode(self, password, salt, *args):
+        return run_bounded(super().encode, password, salt, *args)
+
+    def verify(self, password, encoded):
+        return run_bounded(super().verify, password, encoded)
+
+
+class Argon2PasswordHasher(BoundedHasherMixin, hashers.Argon2PasswordHasher):
+    """ Argon2id with costs from settings """
+
+    # Read on use, so overridden settings apply.
+    @property
+    def time_cost(self):
+        return settings.ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.ARGON2_PARALLELISM
+
+
+class PBKDF2PasswordHasher(BoundedHasherMixin, hashers.PBKDF2PasswordHasher):
+    """ Verifies hashes made before Argon2, which are upgraded on login """
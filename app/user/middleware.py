@@ -0,0 +1,30 @@
+"""
+Middleware answering saturated password hashing with a 429
+"""
+from django.http import HttpResponse
+
+from user.hashers import PasswordHashingBusy
+
+
+class PasswordHashingBusyMiddleware:
+    """ Turn PasswordHashingBusy into a 429 instead of a 500
+
+    Covers the logins outside the API, like the admin's, which call
+    authenticate() without handling the error.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, PasswordHashingBusy):
+            response = HttpResponse(
+                'Too many logins in progress, try again shortly.',
+                status=429, content_type='text/plain',
+            )
+            response['Retry-After'] = '1'
+            return response
+        return None
@@ -6,6 +6,10 @@ from django.contrib.auth import ( get_user_model,
 from django.utils.translation import gettext_lazy as _
 
 from rest_framework import serializers
+from rest_framework.exceptions import Throttled
+
+from user.authentication import revoke_signed_tokens
+from user.hashers import PasswordHashingBusy
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -32,6 +36,8 @@ class UserSerializer(serializers.ModelSerializer):
         if password:
             user.set_password(password)
             user.save()
+            # Tokens issued with the old password stop working.
+            revoke_signed_tokens(user)
 
         return user
 
@@ -52,11 +58,17 @@ class AuthTokenSerializer(serializers.Serializer):
         password = attrs.get('password')
 
         """ Authenticate the user """
-        user = authenticate(
-            request=self.context.get('request'),
-            username=email,
-            password=password
-        )
+        try:
+            user = authenticate(
+                request=self.context.get('request'),
+                username=email,
+                password=password
+            )
+        except PasswordHashingBusy:
+            raise Throttled(
+                wait=1,
+                detail='Too many logins in progress, try again shortly.',
+            )
 
         """ If the user is not found, raise an error """
         if not user:
@@ -0,0 +1,23 @@
+"""
+Signal handlers keeping the token authentication cache current.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from user.authentication import invalidate_token, invalidate_user_tokens
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    """ Stop authenticating a deleted or rotated token from the cache. """
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def forget_saved_user(sender, instance, created, **kwargs):
+    """ Reload users after any change, e.g. a password or is_active. """
+    if not created:
+        invalidate_user_tokens(instance)
@@ -0,0 +1,290 @@
+"""
+Tests for the cached token authentication
+"""
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from user.authentication import (
+    _shared_timeout,
+    _token_cache_key,
+    clear_local_cache,
+    invalidate_token,
+    revoke_signed_tokens,
+)
+
+
+ME_URL = reverse('user:me')
+LOGOUT_URL = reverse('user:logout')
+TOKEN_URL = reverse('user:token')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """ Test tokens are authenticated from the cache until invalidated """
+
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='testpass123', name='Test Name',
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cached_token_skips_database(self):
+        """ Test a repeated request authenticates without queries """
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['email'], self.user.email)
+
+    def test_shared_cache_used_by_other_processes(self):
+        """ Test a process without a local entry uses the shared cache """
+        self.client.get(ME_URL)
+        clear_local_cache()
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_logout_invalidates_token(self):
+        """ Test a logged out token is refused even though it was cached """
+        self.client.get(ME_URL)
+
+        res = self.client.post(LOGOUT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_rotated_token_refused(self):
+        """ Test a deleted token is refused and its replacement accepted """
+        self.client.get(ME_URL)
+        self.token.delete()
+        new_token = Token.objects.create(user=self.user)
+
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {new_token.key}')
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_password_change_reloads_user(self):
+        """ Test changing the password drops the cached user """
+        self.client.get(ME_URL)
+
+        res = self.client.patch(ME_URL, {'password': 'newpassword123'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            self.client.get(ME_URL)
+
+    def test_refill_after_invalidation_skipped(self):
+        """ Test a user read before a concurrent logout is not cached """
+        read = TokenAuthentication.authenticate_credentials
+
+        def read_then_logout(auth, key):
+            result = read(auth, key)
+            invalidate_token(key)
+            return result
+
+        with patch.object(
+            TokenAuthentication, 'authenticate_credentials', read_then_logout,
+        ):
+            self.client.get(ME_URL)
+
+        with self.assertNumQueries(1):
+            self.client.get(ME_URL)
+
+    def test_outdated_generation_refused(self):
+        """ Test a shared entry stored before an invalidation is ignored """
+        self.client.get(ME_URL)
+        cache_key = _token_cache_key(self.token.key)
+        entry = cache.get(cache_key)
+        invalidate_token(self.token.key)
+        cache.set(cache_key, entry)
+
+        with self.assertNumQueries(1):
+            self.client.get(ME_URL)
+
+    def test_per_process_cache_capped_to_local_timeout(self):
+        """ Test a LocMemCache keeps users only as long as the local tier """
+        self.assertEqual(_shared_timeout(), settings.TOKEN_AUTH_LOCAL_TIMEOUT)
+
+        shared = {
+            'default': settings.CACHES['default'],
+            'shared': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+            },
+        }
+        with self.settings(CACHES=shared, TOKEN_AUTH_CACHE_ALIAS='shared'):
+            self.assertEqual(
+                _shared_timeout(), settings.TOKEN_AUTH_CACHE_TIMEOUT,
+            )
+
+    def test_update_does_not_restore_cached_fields(self):
+        """ Test updating the profile keeps changes the cached user missed """
+        self.client.get(ME_URL)
+        # Changed by another process, this one still has the old user.
+        get_user_model().objects.filter(pk=self.user.pk).update(
+            token_version=1, last_login=timezone.now(),
+        )
+
+        res = self.client.patch(ME_URL, {'name': 'New Name'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'New Name')
+        self.assertEqual(self.user.token_version, 1)
+        self.assertIsNotNone(self.user.last_login)
+
+    def test_password_hash_not_cached(self):
+        """ Test the cached user leaves out the password hash """
+        self.client.get(ME_URL)
+        user = cache.get(_token_cache_key(self.token.key))[1]
+
+        self.assertNotIn('password', user.__dict__)
+        self.assertTrue(user.check_password('testpass123'))
+
+    def test_saving_cached_user_keeps_password(self):
+        """ Test saving a user from the cache does not clear its password """
+        self.client.get(ME_URL)
+        user = cache.get(_token_cache_key(self.token.key))[1]
+
+        user.name = 'New Name'
+        user.save()
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'New Name')
+        self.assertTrue(self.user.check_password('testpass123'))
+
+    def test_deactivated_user_refused(self):
+        """ Test a user made inactive can no longer authenticate """
+        self.client.get(ME_URL)
+
+        self.user.is_active = False
+        self.user.save()
+
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class SignedTokenAuthenticationTests(TestCase):
+    """ Test login issues signed tokens checked without the token table """
+
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='testpass123',
+        )
+        self.client = APIClient()
+
+    def _login(self):
+        res = self.client.post(
+            TOKEN_URL,
+            {'email': 'user@example.com', 'password': 'testpass123'},
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {res.data["token"]}',
+        )
+        return res.data['token']
+
+    def test_login_does_not_write(self):
+        """ Test logging in only reads the user """
+        with CaptureQueriesContext(connection) as queries:
+            self._login()
+
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]['sql'].startswith('SELECT'))
+        self.assertFalse(Token.objects.exists())
+
+    def test_signed_token_authenticates(self):
+        """ Test a signed token authenticates, then from the cache """
+        self._login()
+
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.data['email'], self.user.email)
+
+    def test_logout_revokes_signed_tokens(self):
+        """ Test logging out bumps the version, refusing issued tokens """
+        self._login()
+        self.client.get(ME_URL)
+
+        res = self.client.post(LOGOUT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_version, 1)
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(SIGNED_TOKEN_MAX_AGE=-1)
+    def test_expired_token_refused(self):
+        """ Test a token older than SIGNED_TOKEN_MAX_AGE is refused """
+        self._login()
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_tampered_token_refused(self):
+        """ Test a token for another user id fails the signature check """
+        other = get_user_model().objects.create_user(
+            'other@example.com', 'pass12345',
+        )
+        token = self._login()
+        forged = signing.dumps({'u': other.pk, 'v': 0}, salt='forged')
+
+        for key in (token[:-1] + ('A' if token[-1] != 'A' else 'B'), forged):
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+            res = self.client.get(ME_URL)
+            self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_concurrent_revocations_both_count(self):
+        """ Test revoking from outdated copies of the user loses no update """
+        first = get_user_model().objects.get(pk=self.user.pk)
+        second = get_user_model().objects.get(pk=self.user.pk)
+
+        revoke_signed_tokens(first)
+        revoke_signed_tokens(second)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_version, 2)
+        self.assertEqual(second.token_version, 2)
+
+    def test_password_change_revokes_signed_tokens(self):
+        """ Test tokens issued before a password change are refused """
+        token = self._login()
+
+        res = self.client.patch(ME_URL, {'password': 'newpassword123'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
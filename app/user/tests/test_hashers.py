@@ -0,0 +1,138 @@
+"""
+Tests for the password hashers
+"""
+import threading
+from unittest.mock import patch
+
+from django.contrib.auth import authenticate, get_user_model, hashers
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.test import APIClient
+
+from user.hashers import PasswordHashingBusy, slot_keys
+
+
+TOKEN_URL = reverse('user:token')
+
+
+class PasswordHasherTests(TestCase):
+    """ Test Argon2 hashing, legacy upgrades and load shedding """
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+
+    def test_new_password_uses_argon2(self):
+        """ Test new users get an Argon2 hash """
+        user = get_user_model().objects.create_user(
+            'user@example.com', 'testpass123',
+        )
+
+        self.assertTrue(user.password.startswith('argon2$argon2id$'))
+        self.assertTrue(user.check_password('testpass123'))
+
+    def test_legacy_hash_upgraded_on_login(self):
+        """ Test a PBKDF2 hash is replaced by Argon2 when the user logs in """
+        user = get_user_model().objects.create_user('user@example.com')
+        user.password = make_password('testpass123', hasher='pbkdf2_sha256')
+        user.save()
+
+        res = self.client.post(
+            TOKEN_URL,
+            {'email': 'user@example.com', 'password': 'testpass123'},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('argon2$'))
+
+    @override_settings(ARGON2_TIME_COST=1, ARGON2_MEMORY_COST=1024)
+    def test_costs_read_from_settings_on_use(self):
+        """ Test overridden Argon2 costs apply to new hashes """
+        hasher = get_hasher('argon2')
+
+        self.assertEqual((hasher.time_cost, hasher.memory_cost), (1, 1024))
+        self.assertIn('m=1024,t=1', make_password('testpass123'))
+
+    def _saturate(self):
+        """ Take every hashing slot, as busy workers elsewhere would """
+        get_user_model().objects.create_user('user@example.com', 'testpass123')
+        cache.set_many(dict.fromkeys(slot_keys(), True))
+
+    def test_slot_released_after_login(self):
+        """ Test a login frees its hashing slot for the next one """
+        get_user_model().objects.create_user('user@example.com', 'testpass123')
+
+        res = self.client.post(
+            TOKEN_URL,
+            {'email': 'user@example.com', 'password': 'testpass123'},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(cache.get_many(slot_keys()), {})
+
+    @override_settings(PASSWORD_HASH_SLOTS=1, PASSWORD_HASH_TIMEOUT=0)
+    def test_login_refused_while_another_hash_runs(self):
+        """ Test a login is answered with 429 while the only slot hashes """
+        get_user_model().objects.create_user('user@example.com', 'testpass123')
+        hashing, release = threading.Event(), threading.Event()
+        encode = hashers.Argon2PasswordHasher.encode
+
+        def slow_encode(hasher, *args):
+            hashing.set()
+            release.wait(5)
+            return encode(hasher, *args)
+
+        with patch.object(hashers.Argon2PasswordHasher, 'encode', slow_encode):
+            other = threading.Thread(target=make_password, args=('other',))
+            other.start()
+            self.addCleanup(other.join)
+            self.addCleanup(release.set)
+            hashing.wait(5)
+            res = self.client.post(
+                TOKEN_URL,
+                {'email': 'user@example.com', 'password': 'testpass123'},
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+
+    @override_settings(PASSWORD_HASH_TIMEOUT=0)
+    def test_login_refused_when_hashing_saturated(self):
+        """ Test logins are answered with 429 once every slot is taken """
+        self._saturate()
+
+        res = self.client.post(
+            TOKEN_URL,
+            {'email': 'user@example.com', 'password': 'testpass123'},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+
+    @override_settings(PASSWORD_HASH_TIMEOUT=0)
+    def test_authenticate_raises_plain_error_when_saturated(self):
+        """ Test authenticate() does not raise an API exception """
+        self._saturate()
+
+        with self.assertRaises(PasswordHashingBusy) as cm:
+            authenticate(username='user@example.com', password='testpass123')
+
+        self.assertNotIsInstance(cm.exception, APIException)
+
+    @override_settings(PASSWORD_HASH_TIMEOUT=0)
+    def test_admin_login_refused_when_hashing_saturated(self):
+        """ Test the admin login is answered with 429, not a server error """
+        self._saturate()
+
+        res = self.client.post(reverse('admin:login'), {
+            'username': 'user@example.com', 'password': 'testpass123',
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '1')
@@ -1,10 +1,20 @@
 """
 View for the user API.
 """
-from rest_framework import generics, authentication, permissions
+from django.contrib.auth import get_user_model
+
+from rest_framework import generics, permissions, status
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
+from user.authentication import (
+    SignedTokenAuthentication,
+    issue_signed_token,
+    revoke_signed_tokens,
+)
 from user.serializers import (UserSerializer, AuthTokenSerializer)
 
 
@@ -18,15 +28,41 @@ class CreateTokenView(ObtainAuthToken):
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    def post(self, request, *args, **kwargs):
+        """ Issue a signed token, without writing to the database """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+
+        return Response({'token': issue_signed_token(user)})
+
 
 class ManageUserView(generics.RetrieveUpdateAPIView):
     """ Manage the authenticated user """
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (SignedTokenAuthentication,)
     """ We want to make sure that the user is authenticated before they can access this endpoint. """
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
         """ Retrieve and return authenticated user """
-        return self.request.user
+        if self.request.method in permissions.SAFE_METHODS:
+            return self.request.user
+        # request.user may be a cached copy, updates start from the
+        # current row so they never write outdated fields back.
+        return get_user_model().objects.get(pk=self.request.user.pk)
+
+
+class LogoutView(APIView):
+    """ Log out by revoking the auth token of the request """
+    authentication_classes = (SignedTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
 
+    def post(self, request):
+        """ Delete a legacy token, or revoke the user's signed tokens """
+        if isinstance(request.auth, Token):
+            # Deleting also drops it from the cache.
+            Token.objects.filter(key=request.auth.key).delete()
+        else:
+            revoke_signed_tokens(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
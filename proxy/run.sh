@@ -2,5 +2,10 @@
 
 set -e
 
-envsubst < /etc/nginx/default.conf.tpl > /etc/nginx/conf.d/default.conf
-nginx -g 'daemon off;'
\ No newline at end of file
+# APP_SERVER=asgi talks HTTP to gunicorn, anything else uwsgi to uWSGI.
+if [ "${APP_SERVER}" = "asgi" ]; then
+    envsubst '${LISTEN_PORT} ${APP_HOST} ${APP_PORT}' < /etc/nginx/default.asgi.conf.tpl > /etc/nginx/conf.d/default.conf
+else
+    envsubst < /etc/nginx/default.conf.tpl > /etc/nginx/conf.d/default.conf
+fi
+nginx -g 'daemon off;'
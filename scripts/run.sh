@@ -5,5 +5,18 @@ set -e
 python manage.py wait_for_db
 python manage.py collectstatic --noinput
 python manage.py migrate
+# Jobs left behind by a restart are picked up in the background, so a
+# long backlog does not delay the app server.
+python manage.py process_image_jobs &
 
-uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi
+# APP_SERVER=asgi serves app.asgi with uvicorn workers under gunicorn,
+# anything else the WSGI app with uWSGI. Both listen on :9000, the proxy
+# must be started with the same APP_SERVER.
+if [ "${APP_SERVER:-uwsgi}" = "asgi" ]; then
+    gunicorn app.asgi:application \
+        --bind :9000 \
+        --workers "${APP_WORKERS:-4}" \
+        --worker-class uvicorn.workers.UvicornWorker
+else
+    uwsgi --socket :9000 --workers "${APP_WORKERS:-4}" --master --enable-threads --module app.wsgi
+fi